@@ -0,0 +1,42 @@
+
+
+import time
+from uuid import UUID
+
+from deva_p1_db.models import Task
+from redis.asyncio import Redis
+
+from back.config import Config
+from back.schemas.task import RedisTaskCacheSchema
+from database.redis import RedisType
+
+# One hash per project, task_type -> RedisTaskCacheSchema. Every entry carries
+# its own deadline, so a task whose done/error message got lost still stops
+# blocking the project after redis_task_status_lifetime like before.
+
+
+async def set_active_task(redis: Redis, task: Task, project_id: UUID) -> None:
+    cached = RedisTaskCacheSchema.from_db(task)
+    cached.expires_at = time.time() + Config.redis_task_status_lifetime
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(f"{RedisType.task_cache}:{project_id}", task.task_type, cached.model_dump_json())
+        pipe.expire(f"{RedisType.task_cache}:{project_id}", Config.redis_task_status_lifetime)
+        await pipe.execute()
+
+
+async def drop_active_tasks(redis: Redis, project_id: UUID, task_types: list[str]) -> None:
+    if task_types:
+        await redis.hdel(f"{RedisType.task_cache}:{project_id}", *task_types)  # type: ignore
+
+
+async def get_active_tasks(redis: Redis, project_id: UUID) -> dict[str, RedisTaskCacheSchema]:
+    """A single HGETALL over at most one field per task type. Stale entries
+    are skipped rather than deleted, a concurrent set may have replaced them."""
+    entries = await redis.hgetall(f"{RedisType.task_cache}:{project_id}")  # type: ignore
+    now = time.time()
+    active: dict[str, RedisTaskCacheSchema] = {}
+    for task_type, value in entries.items():
+        cached = RedisTaskCacheSchema.model_validate_json(value)
+        if cached.expires_at > now:
+            active[task_type] = cached
+    return active
@@ -4,15 +4,19 @@ from fastapi import APIRouter
 
 from .auth import router as auth_router
 from .file import router as file_router
+from .metrics import router as metrics_router
 from .note import router as note_router
 from .project import router as project_router
 from .share import router as share_router
 from .task import router as task_router
+from .upload import router as upload_router
 
 router = APIRouter(prefix="/api")
 router.include_router(auth_router)
+router.include_router(upload_router)
 router.include_router(file_router)
 router.include_router(note_router)
 router.include_router(project_router)
 router.include_router(task_router)
 router.include_router(share_router)
+router.include_router(metrics_router)
@@ -2,17 +2,23 @@
 from datetime import UTC, datetime
 
 from deva_p1_db.models.user import User
-from deva_p1_db.repositories.user_repository import UserRepository
 from fastapi import APIRouter, Cookie, Depends, Request, Response
 from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from back.config import Config
 from back.depends import get_user, get_user_db, get_user_repo
 from back.exceptions import *
+from back.password import PasswordHasher, get_password_hasher
+from back.rate_limit import RateLimit, RateLimitAttempt, hit_rate_limits
 from back.schemas.user import (CredsSchema, RegisterSchema, UserSchema,
                                UserUpdateSchema)
 from back.token import AccessToken, RefreshToken
+from back.token_cache import invalidate_access_tokens
+from back.user_cache import get_cached_user, invalidate_cached_user
+from database.database import session_manager
 from database.redis import RedisType, get_redis_client
+from database.user_repository import UserRepository
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -20,6 +26,7 @@ router = APIRouter(prefix="/auth", tags=["auth"])
 @router.post("/refresh")
 async def refresh(response: Response,
                   refresh_token: str = Cookie(None),
+                  redis: Redis = Depends(get_redis_client),
                   ur: UserRepository = Depends(get_user_repo)
                   ):
     if refresh_token is None:
@@ -28,40 +35,57 @@ async def refresh(response: Response,
     current_time = datetime.now(UTC).replace(tzinfo=None)
     if refresh.created_date > current_time or refresh.created_date + refresh.lifetime < current_time:
         raise RefreshTokenExpiredException()
-    user = await ur.get_by_id(refresh.user_id)
+    user = await get_cached_user(redis, ur, refresh.user_id)
     if user is None:
         raise InvalidRefreshTokenException()
     if user.secret != refresh.secret:
         raise InvalidRefreshTokenException()
-    access = AccessToken(user, current_time)
+    access = AccessToken(user.to_schema(), current_time)
     response.set_cookie(key="access_token", value=access.to_token(
     ), max_age=Config.access_token_lifetime, httponly=True)
     return {"message": "OK"}
 
 
+async def check_credentials_attempt(redis: Redis, ip: str, login: str) -> RateLimitAttempt:
+    """Counts the attempt against the per-IP and per-login windows. Successful
+    attempts are forgiven afterwards, so only failures use up the limits."""
+    attempt = await hit_rate_limits(redis, [
+        RateLimit(f"{RedisType.incorrect_credentials_ip}:{ip}", Config.ip_buffer, Config.ip_buffer_lifetime),
+        RateLimit(f"{RedisType.incorrect_credentials}:{login}", Config.login_attempts, Config.login_gap),
+    ])
+    if attempt.exceeded is not None:
+        if attempt.exceeded is attempt.limits[0]:
+            raise TooManyIncorrectCredentialsException(ip, attempt.lockout)
+        raise LoginLockedException(attempt.lockout)
+    return attempt
+
+
+async def check_register_attempt(redis: Redis, ip: str) -> None:
+    """Register has its own per-IP window, so sign-up attempts never lock
+    the IP or the login out of logging in."""
+    attempt = await hit_rate_limits(redis, [
+        RateLimit(f"{RedisType.register_attempts_ip}:{ip}", Config.register_attempts,
+                  Config.register_attempts_lifetime),
+    ])
+    if attempt.exceeded is not None:
+        raise LoginLockedException(attempt.lockout)
+
+
 @router.post("/register")
 async def register(request: Request,
                    register_data: RegisterSchema,
                    redis: Redis = Depends(get_redis_client),
-                   ur: UserRepository = Depends(get_user_repo)
+                   ur: UserRepository = Depends(get_user_repo),
+                   password_hasher: PasswordHasher = Depends(get_password_hasher)
                    ):
-    lock_time = await redis.ttl(f"{RedisType.invalidated_access_token}:{register_data.login}")
-    if lock_time > 0:
-        raise LoginLockedException(lock_time)
-    ip = request.client.host  # type: ignore
-    ip_counter = await redis.get(f"{RedisType.incorrect_credentials_ip}:{ip}")
-    if ip_counter is not None:
-        if int(ip_counter) >= Config.ip_buffer:
-            raise TooManyIncorrectCredentialsException(ip)
-    else:
-        ip_counter = 0
     if register_data.password != register_data.password_repeat:
         raise PasswordsDoNotMatchException()
+    await check_register_attempt(redis, request.client.host)  # type: ignore
     if await ur.get_by_login(register_data.login) is not None:
         raise UserAlreadyExistsException()
-    user = await ur.create(register_data.login, register_data.password)
-    if user is None:
-        raise SendFeedbackToAdminException()
+    # not ur.create, which would hash on the event loop
+    await ur.create_with_hash(register_data.login,
+                              await password_hasher.hash(register_data.password))
     return {"message": "OK"}
 
 
@@ -70,22 +94,16 @@ async def login(request: Request,
                 response: Response,
                 credentials: CredsSchema,
                 redis: Redis = Depends(get_redis_client),
-                ur: UserRepository = Depends(get_user_repo)
+                ur: UserRepository = Depends(get_user_repo),
+                password_hasher: PasswordHasher = Depends(get_password_hasher)
                 ):
-    lock_time = await redis.ttl(f"{RedisType.invalidated_access_token}:{credentials.login}")
-    if lock_time > 0:
-        raise LoginLockedException(lock_time)
     ip = request.client.host  # type: ignore
-    ip_counter = await redis.get(f"{RedisType.incorrect_credentials_ip}:{ip}")
-    if ip_counter is not None:
-        if int(ip_counter) >= Config.ip_buffer:
-            raise TooManyIncorrectCredentialsException(ip)
-    else:
-        ip_counter = 0
-    user = await ur.get_by_auth(credentials.login, credentials.password)
-    if user is None:
-        await redis.set(f"{RedisType.incorrect_credentials_ip}:{ip}", int(ip_counter) + 1, ex=Config.ip_buffer_lifetime)
+    attempt = await check_credentials_attempt(redis, ip, credentials.login)
+    user = await ur.get_by_login(credentials.login)
+    verified = await password_hasher.verify(user.hashed_password if user else None, credentials.password)
+    if user is None or not verified:
         raise InvalidCredentialsException()
+    await attempt.forgive(redis)
     refresh = RefreshToken(user_id=user.id, secret=user.secret)
     access = AccessToken(user)
     response.set_cookie(key="refresh_token", value=refresh.to_token(
@@ -109,9 +127,12 @@ async def logout(response: Response,
 @router.post("/logout_all")
 async def logout_all(response: Response,
                      user: User = Depends(get_user_db),
+                     redis: Redis = Depends(get_redis_client),
                      ur: UserRepository = Depends(get_user_repo)
                      ):
     await ur.update_secret(user)
+    await invalidate_cached_user(redis, user.id)
+    await invalidate_access_tokens(redis, user.id)
     response.delete_cookie(key="refresh_token")
     response.delete_cookie(key="access_token")
     return {"message": "OK"}
@@ -120,11 +141,19 @@ async def logout_all(response: Response,
 @router.patch("/update_credentials")
 async def update_creds(user_update: UserUpdateSchema,
                        user: User = Depends(get_user_db),
-                       ur: UserRepository = Depends(get_user_repo)
+                       redis: Redis = Depends(get_redis_client),
+                       password_hasher: PasswordHasher = Depends(get_password_hasher),
+                       session: AsyncSession = Depends(session_manager.session)
                        ):
     if user_update.new_password != user_update.new_password_repeat:
         raise PasswordsDoNotMatchException()
-    await ur.update_credentials(user, user_update.new_login, user_update.new_password)
+    if user_update.new_login is not None:
+        user.login = user_update.new_login
+    if user_update.new_password is not None:
+        user.hashed_password = await password_hasher.hash(user_update.new_password)
+    await session.commit()
+    await invalidate_cached_user(redis, user.id)
+    await invalidate_access_tokens(redis, user.id)
     return {"message": "OK"}
 
 
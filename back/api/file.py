@@ -1,58 +1,69 @@
 
 
+import asyncio
 import mimetypes
 import re
 from datetime import timedelta
-from io import BytesIO
-from typing import Annotated
+from email.utils import format_datetime, parsedate_to_datetime
+from uuid import UUID
 
 from deva_p1_db.enums.file_type import FileCategory, resolve_file_type
 from deva_p1_db.models import File, Project, User
 from deva_p1_db.repositories import FileRepository, ProjectRepository
 from fastapi import APIRouter, Depends
-from fastapi import File as fastapi_file
-from fastapi import Request, UploadFile
-from fastapi.responses import StreamingResponse
-from minio import Minio, S3Error
+from fastapi import Query, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from minio import S3Error
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.types import Receive, Scope, Send
 
 from back.config import Config
-from back.depends import (get_file, get_file_editor, get_file_repo,
-                          get_file_viewer, get_project, get_project_editor,
-                          get_project_repo)
+from back.content_index import (get_object_names, is_deduplicated,
+                                 store_content)
+from back.depends import (get_file, get_file_editor, get_file_meta,
+                          get_file_repo, get_file_viewer, get_project,
+                          get_project_editor, get_project_repo,
+                          get_project_viewer, invalidate_file_meta)
 from back.exceptions import *
-from back.schemas.file import FileEditSchema, FileSchema
+from back.image_derivatives import (get_derivative_names,
+                                    schedule_image_derivatives)
+from back.multipart import MultipartFileReader
+from back.project_version import mark_project_updated
+from back.schemas.file import (FileDownloadURLSchema, FileEditSchema,
+                               FileMetaSchema, FileSchema)
 from back.schemas.user import UserSchema
-from config import settings
 from database.database import session_manager
-from database.minio import get_s3_client
+from database.media_cache import CachedSegment, MediaCache, get_media_cache
+from database.minio import AsyncMinio, UploadLimitExceeded, get_s3_client
 from database.redis import RedisType, get_redis_client
 from redis.asyncio import Redis
 
 router = APIRouter(prefix="/file", tags=["file"])
 
 
-@router.post("/{project_id}")
-async def upload_file(file: Annotated[UploadFile, fastapi_file(...)],
-                      project: Project = Depends(get_project),
-                      user: UserSchema = Depends(get_project_editor),
-                      minio_client: Minio = Depends(get_s3_client),
-                      redis: Redis = Depends(get_redis_client),
-                      fr: FileRepository = Depends(get_file_repo),
-                      pr: ProjectRepository = Depends(get_project_repo),
-                      session: AsyncSession = Depends(session_manager.session)
-                      ) -> FileSchema:
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
 
-    if file.filename is None:
-        file.filename = ""
 
-    content_type = mimetypes.guess_type(file.filename)[0]
+def check_upload_type(file_name: str, project: Project) -> str:
+    content_type = mimetypes.guess_type(file_name)[0]
     if content_type is None:
         raise UndefinedFileTypeException()
-    await redis.set(f"{RedisType.project_update}:{project.id}", 1, ex=Config.websocket_redis_message_lifetime)
 
-    file_type = resolve_file_type(content_type)
-    file_category = file_type.category
+    file_category = resolve_file_type(content_type).category
 
     if file_category not in [FileCategory.audio.value,
                              FileCategory.video.value,
@@ -65,45 +76,101 @@ async def upload_file(file: Annotated[UploadFile, fastapi_file(...)],
                          FileCategory.video.value] \
             and project.origin_file_id is not None:
         raise ProjectAlreadyHasOriginFileException()
+    return content_type
 
-    file_data = await file.read()
-    file_size = len(file_data)
+
+async def link_file_to_project(pr: ProjectRepository,
+                               project: Project,
+                               db_file: File,
+                               file_category: str
+                               ) -> None:
+    go_down = False
+    match file_category:
+        case FileCategory.audio.value:
+            go_down = True
+        case value if value is FileCategory.video.value or go_down:
+            await pr.add_origin_file(project, db_file)
+        case FileCategory.transcribe.value:
+            await pr.add_transcription_file(project, db_file)
+        case FileCategory.summary.value:
+            await pr.add_summary_file(project, db_file)
+
+
+def check_upload_headers(request: Request) -> None:
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise UnsupportedUploadContentTypeException()
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() \
+            and int(content_length) > Config.upload_max_size:
+        raise FileTooLargeException(Config.upload_max_size)
+
+
+@router.post("/{project_id}", openapi_extra=UPLOAD_OPENAPI)
+async def upload_file(request: Request,
+                      project: Project = Depends(get_project),
+                      user: UserSchema = Depends(get_project_editor),
+                      minio_client: AsyncMinio = Depends(get_s3_client),
+                      redis: Redis = Depends(get_redis_client),
+                      fr: FileRepository = Depends(get_file_repo),
+                      pr: ProjectRepository = Depends(get_project_repo),
+                      session: AsyncSession = Depends(session_manager.session)
+                      ) -> FileSchema:
+    check_upload_headers(request)
+
+    reader = MultipartFileReader(request.stream(), request.headers["content-type"])
+    file_name = await reader.open()
+
+    content_type = check_upload_type(file_name, project)
+    await mark_project_updated(redis, project.id)
+
+    file_type = resolve_file_type(content_type)
+    file_category = file_type.category
 
     db_file = await fr.create(
-        file_name=file.filename,
+        file_name=file_name,
         file_type=file_type.internal,
         user=project.holder,
-        file_size=file_size,
+        file_size=0,
         project=project
     )
 
     if db_file is None:
         raise SendFeedbackToAdminException()
 
+    file_id = db_file.id
+    object_name = str(file_id)
     try:
-        minio_client.put_object(
-            bucket_name=settings.minio_bucket,
-            object_name=str(db_file.id),
-            data=BytesIO(file_data),
-            length=file_size,
-            content_type=content_type
-        )
-    except S3Error as e:
+        try:
+            stream = await minio_client.put_stream(
+                object_name=object_name,
+                chunks=aiter(reader),
+                content_type=content_type,
+                part_size=Config.upload_part_size,
+                max_size=Config.upload_max_size,
+                num_parallel_uploads=Config.upload_parallel_parts
+            )
+            if is_deduplicated(file_category):
+                object_name = await store_content(redis, minio_client, file_id,
+                                                  stream.sha256, object_name)
+        except UploadLimitExceeded:
+            raise FileTooLargeException(Config.upload_max_size)
+        except S3Error as e:
+            raise MinioException(e.message)
+    except Exception:
+        # the row is committed before the upload so the object can be named
+        # after it; a failed or disconnected upload must not leave it behind
         await session.rollback()
-        raise MinioException(e.message)
-    finally:
-        await file.close()
+        await session.execute(delete(File).where(File.id == file_id))
+        await session.commit()
+        raise
 
-    go_down = False
-    match file_category:
-        case FileCategory.audio.value:
-            go_down = True
-        case value if value is FileCategory.video.value or go_down:
-            await pr.add_origin_file(project, db_file)
-        case FileCategory.transcribe.value:
-            await pr.add_transcription_file(project, db_file)
-        case FileCategory.summary.value:
-            await pr.add_summary_file(project, db_file)
+    db_file.file_size = stream.size
+    await session.commit()
+
+    await link_file_to_project(pr, project, db_file, file_category)
+    if file_category == FileCategory.image.value:
+        schedule_image_derivatives([object_name])
 
     return FileSchema.from_db(db_file)
 
@@ -115,7 +182,8 @@ async def update_file(edited_fields: FileEditSchema,
                       redis: Redis = Depends(get_redis_client),
                       fr: FileRepository = Depends(get_file_repo)
                       ) -> FileSchema:
-    await redis.set(f"{RedisType.project_update}:{file.project.id}", 1, ex=Config.websocket_redis_message_lifetime)
+    await mark_project_updated(redis, file.project.id)
+    await invalidate_file_meta(redis, file.id)
     await fr.update_metadata(
         file=file,
         is_hide=edited_fields.metadata_is_hide,
@@ -135,7 +203,8 @@ async def hide_file(file: File = Depends(get_file),
                     pr: ProjectRepository = Depends(get_file_repo)
                     ) -> None:
     project = file.project
-    await redis.set(f"{RedisType.project_update}:{project.id}", 1, ex=Config.websocket_redis_message_lifetime)
+    await mark_project_updated(redis, project.id)
+    await invalidate_file_meta(redis, file.id)
     category = resolve_file_type(file.file_type).category
     go_down = False
     match category:
@@ -155,82 +224,235 @@ async def hide_file(file: File = Depends(get_file),
                 await pr.delete_summary_file(project)
 
 
+def is_not_modified(request: Request, meta: FileMetaSchema) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = [etag.strip().removeprefix("W/") for etag in if_none_match.split(",")]
+        return "*" in etags or f'"{meta.etag}"' in etags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        return meta.last_modified.replace(microsecond=0) <= since
+    return False
+
+
 @router.get("/download/{file_id}")
-async def download_file(file: File = Depends(get_file),
+async def download_file(request: Request,
+                        file: File = Depends(get_file),
                         user: User = Depends(get_file_viewer),
-                        minio_client: Minio = Depends(get_s3_client)
+                        meta: FileMetaSchema = Depends(get_file_meta),
+                        size: int | None = None,
+                        minio_client: AsyncMinio = Depends(get_s3_client),
+                        redis: Redis = Depends(get_redis_client)
                         ):
+    if size is not None:
+        object_name = (await get_file_object_names(redis, [file], size))[file.id]
+        if object_name != meta.object_name:
+            return RedirectResponse((await get_download_urls(redis, minio_client, [object_name]))[object_name])
+
+    headers = {
+        "ETag": f'"{meta.etag}"',
+        "Last-Modified": format_datetime(meta.last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+    if is_not_modified(request, meta):
+        return Response(status_code=304, headers=headers)
+
     try:
-        response = minio_client.get_object(
-            bucket_name=settings.minio_bucket,
-            object_name=str(file.id),
-        )
+        # full downloads skip the media cache, they would only push out hot video segments
+        response = await minio_client.get_object(meta.object_name)
     except S3Error as e:
         raise MinioException(e.message)
+    headers["Content-Disposition"] = f'attachment; filename="{file.file_name}"'
+    headers["Content-Length"] = str(meta.size)
     return StreamingResponse(
         response,
         media_type="application/octet-stream",
-        headers={"Content-Disposition": f'attachment; filename="{file.file_name}"'})
+        headers=headers)
+
+
+async def get_file_object_names(redis: Redis,
+                                files: list[File],
+                                size: int | None = None
+                                ) -> dict[UUID, str]:
+    object_names = await get_object_names(redis, [f.id for f in files])
+    if size is None:
+        return object_names
+    images = [f.id for f in files if resolve_file_type(f.file_type).category == FileCategory.image.value]
+    derivatives = await get_derivative_names(redis, [object_names[file_id] for file_id in images], size)
+    for file_id in images:
+        object_names[file_id] = derivatives[object_names[file_id]]
+    return object_names
+
+
+async def get_download_urls(redis: Redis,
+                            minio_client: AsyncMinio,
+                            object_names: list[str]
+                            ) -> dict[str, str]:
+    if not object_names:
+        return {}
+    cached = await redis.mget([f"{RedisType.file_url}:{object_name}" for object_name in object_names])
+    urls = {object_name: url for object_name, url in zip(object_names, cached) if url is not None}
+    missing = [object_name for object_name in object_names if object_name not in urls]
+    if missing:
+        signed = await minio_client.presigned_get_objects(
+            missing,
+            expires=timedelta(seconds=Config.minio_url_live_time)
+        )
+        # drop cached urls a bit before they expire so clients never get a dead one
+        async with redis.pipeline(transaction=False) as pipe:
+            for object_name, url in zip(missing, signed):
+                pipe.set(f"{RedisType.file_url}:{object_name}", url,
+                         ex=Config.minio_url_live_time - Config.minio_url_refresh_gap)
+                urls[object_name] = url
+            await pipe.execute()
+    return urls
 
 
 @router.get("/minio_url/{file_id}")
 async def get_minio_url(file: File = Depends(get_file),
                         user: User = Depends(get_file_viewer),
-                        minio_client: Minio = Depends(get_s3_client)
+                        size: int | None = None,
+                        minio_client: AsyncMinio = Depends(get_s3_client),
+                        redis: Redis = Depends(get_redis_client)
                         ) -> str:
+    object_name = (await get_file_object_names(redis, [file], size))[file.id]
+    return (await get_download_urls(redis, minio_client, [object_name]))[object_name]
+
+
+@router.get("/minio_urls/{project_id}")
+async def get_minio_urls(project: Project = Depends(get_project),
+                         user: User = Depends(get_project_viewer),
+                         category: str | None = None,
+                         file_id: list[UUID] | None = Query(None),
+                         size: int | None = None,
+                         minio_client: AsyncMinio = Depends(get_s3_client),
+                         redis: Redis = Depends(get_redis_client),
+                         fr: FileRepository = Depends(get_file_repo),
+                         session: AsyncSession = Depends(session_manager.session)
+                         ) -> list[FileDownloadURLSchema]:
+    if file_id is not None:
+        files = list(await session.scalars(
+            select(File).where(File.project_id == project.id, File.id.in_(file_id))))
+    else:
+        files = await fr.get_by_project(project)
+    if category is not None:
+        files = [f for f in files if resolve_file_type(f.file_type).category == category]
+    object_names = await get_file_object_names(redis, files, size)
+    urls = await get_download_urls(redis, minio_client, list(object_names.values()))
+    return [FileDownloadURLSchema.from_db(f, urls[object_names[f.id]]) for f in files]
+
+
+def parse_range(range_header: str, file_size: int) -> tuple[int, int]:
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        raise InvalidRangeHeaderException(file_size)
+
+    if not match.group(1):
+        suffix_length = int(match.group(2))
+        if suffix_length == 0:
+            raise InvalidRangeHeaderException(file_size)
+        return max(file_size - suffix_length, 0), file_size - 1
+
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else file_size - 1
+    if start >= file_size or end < start:
+        raise InvalidRangeHeaderException(file_size)
+    return start, min(end, file_size - 1)
+
+
+def if_range_matches(if_range: str | None, meta: FileMetaSchema) -> bool:
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == f'"{meta.etag}"'
+    if if_range.startswith("W/"):
+        return False
+    return if_range == format_datetime(meta.last_modified, usegmt=True)
+
+
+class SegmentResponse(Response):
+    """Sends a cached segment straight from its file. Servers offering the
+    zerocopysend extension get the descriptor to sendfile from, others get
+    it in chunks read on a thread."""
+    chunk_size = 64 * 1024
+
+    def __init__(self, segment: CachedSegment, status_code: int, headers: dict[str, str]) -> None:
+        self.segment = segment
+        self.status_code = status_code
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": self.segment.file,
+                            "offset": self.segment.offset, "count": self.segment.length})
+                return
+            sent = 0
+            while sent < self.segment.length:
+                chunk = await asyncio.to_thread(self.segment.read, sent,
+                                                min(self.chunk_size, self.segment.length - sent))
+                sent += len(chunk)
+                await send({"type": "http.response.body", "body": chunk,
+                            "more_body": sent < self.segment.length and bool(chunk)})
+                if not chunk:
+                    break
+        finally:
+            self.segment.close()
 
-    return minio_client.presigned_get_object(
-        bucket_name=settings.minio_bucket,
-        object_name=str(file.id),
-        expires=timedelta(seconds=Config.minio_url_live_time)
-    )
 
 
 @router.get("/video/{file_id}")
 async def stream_video(request: Request,
                        file: File = Depends(get_file),
                        user: User = Depends(get_file_viewer),
-                       minio_client: Minio = Depends(get_s3_client)
+                       meta: FileMetaSchema = Depends(get_file_meta),
+                       minio_client: AsyncMinio = Depends(get_s3_client),
+                       media_cache: MediaCache = Depends(get_media_cache)
                        ):
     range_header = request.headers.get("range")
     if range_header is None:
         raise RangeHeaderRequiredException()
 
-    match = re.match(r"bytes=(\d+)-(\d*)", range_header)
-    if not match:
-        raise InvalidRangeHeaderException()
-
-    start = int(match.group(1))
-    end = int(match.group(2)) if match.group(2) else None
-
-    try:
-
-        stat = minio_client.stat_object(
-            settings.minio_bucket, str(file.id))
-        file_size = stat.size
-        if file_size is None:
-            raise FileNotFoundException(file.id)
-
-        if end is None or end >= file_size:
-            end = file_size - 1
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Type": meta.content_type,
+        "ETag": f'"{meta.etag}"',
+        "Last-Modified": format_datetime(meta.last_modified, usegmt=True),
+    }
 
-        content_length = end - start + 1
+    if not if_range_matches(request.headers.get("if-range"), meta):
+        try:
+            response = await minio_client.get_object(meta.object_name)
+        except S3Error as e:
+            raise MinioException(e.message)
+        headers["Content-Length"] = str(meta.size)
+        return StreamingResponse(response, status_code=200, headers=headers)
 
-        response = minio_client.get_object(
-            settings.minio_bucket,
-            str(file.id),
-            offset=start,
-            length=content_length
-        )
+    start, end = parse_range(range_header, meta.size)
 
+    try:
+        segment = await media_cache.open(minio_client, meta.object_name, meta.etag, meta.size, start, end)
+        if segment is None:
+            response = await minio_client.get_object(meta.object_name, offset=start, length=end - start + 1)
     except S3Error as e:
         raise MinioException(e.message)
 
-    headers = {
-        "Content-Range": f"bytes {start}-{end}/{file_size}",
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(content_length),
-        "Content-Type": "video/mp4",
-    }
+    if segment is not None:
+        # a cached answer stops at the end of its segment, players ask for the rest next
+        end = start + segment.length - 1
+    headers["Content-Range"] = f"bytes {start}-{end}/{meta.size}"
+    headers["Content-Length"] = str(end - start + 1)
 
+    if segment is not None:
+        return SegmentResponse(segment, status_code=206, headers=headers)
     return StreamingResponse(response, status_code=206, headers=headers)
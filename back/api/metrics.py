@@ -0,0 +1,13 @@
+
+from typing import Any
+
+from fastapi import APIRouter
+
+from back.metrics import collect_metrics
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("")
+async def get_metrics() -> dict[str, dict[str, Any]]:
+    return collect_metrics()
@@ -6,15 +6,15 @@ from deva_p1_db.models import File, Note, User
 from deva_p1_db.repositories import NoteRepository
 from fastapi import APIRouter, Depends
 
-from back.config import Config
 from back.depends import (get_file, get_file_editor, get_file_viewer, get_note,
                           get_note_editor, get_note_repo, get_user)
 from back.exceptions import *
+from back.project_version import mark_project_updated
 from back.schemas.note import CreateNoteSchema, NoteSchema, UpdateNoteSchema
 from back.schemas.user import UserSchema
 from redis.asyncio import Redis
 
-from database.redis import RedisType, get_redis_client
+from database.redis import get_redis_client
 
 router = APIRouter(prefix="/note", tags=["note"])
 
@@ -26,7 +26,7 @@ async def create_note(new_note: CreateNoteSchema,
                       redis: Redis = Depends(get_redis_client),
                       nr: NoteRepository = Depends(get_note_repo)
                       ) -> NoteSchema:
-    await redis.set(f"{RedisType.project_update}:{file.project.id}", 1, ex=Config.websocket_redis_message_lifetime)
+    await mark_project_updated(redis, file.project.id)
     note = await nr.create(file=file,
                            text=new_note.text,
                            start_time_code=new_note.start_time_code,
@@ -51,7 +51,7 @@ async def update_note(update_data: UpdateNoteSchema,
                       redis: Redis = Depends(get_redis_client),
                       nr: NoteRepository = Depends(get_note_repo)
                       ) -> NoteSchema:
-    await redis.set(f"{RedisType.project_update}:{note.file.project.id}", 1, ex=Config.websocket_redis_message_lifetime)
+    await mark_project_updated(redis, note.file.project.id)
     await nr.update(note,
                     update_data.new_text,
                     update_data.new_start_time_code,
@@ -68,6 +68,6 @@ async def delete_note(note: Note = Depends(get_note),
                       redis: Redis = Depends(get_redis_client),
                       nr: NoteRepository = Depends(get_note_repo)
                       ):
-    await redis.set(f"{RedisType.project_update}:{note.file.project.id}", 1, ex=Config.websocket_redis_message_lifetime)
+    await mark_project_updated(redis, note.file.project.id)
     await nr.delete(note)
     return {"message": "OK"}
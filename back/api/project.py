@@ -1,34 +1,37 @@
 
 
-import shutil
-from copy import deepcopy
-from io import BytesIO
-from zipfile import ZIP_DEFLATED, ZipFile
+
+from datetime import timedelta
 
 from deva_p1_db.models import Project, User
 from deva_p1_db.repositories import (FileRepository, ProjectRepository,
                                      TaskRepository)
 from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
-from fastapi.responses import StreamingResponse
-from minio import Minio
+from fastapi.responses import RedirectResponse, StreamingResponse
+from minio import S3Error
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from back.archive import (archive_object_name, remove_project_archives,
+                          store_archive, stream_project_archive)
 from back.config import Config
+from back.content_index import get_object_names, release_content
 from back.depends import (get_file_repo, get_project, get_project_editor,
                           get_project_repo, get_project_viewer, get_task_repo,
                           get_user_db)
 from back.exceptions import *
-from back.schemas.file import FileSchema
+from back.project_version import get_project_version, mark_project_updated
+from back.schemas.file import FileDownloadURLSchema, FileSchema
 from back.schemas.project import (CreateProjectSchema, EditProjectSchema,
                                   ProjectSchema)
 from back.schemas.task import ActiveTaskSchema
 from back.schemas.websocket import WebsocketMessage
 from back.websocket.start_polling import start_polling
-from config import settings
 from database.database import session_manager
-from database.minio import get_s3_client
-from database.redis import RedisType, get_redis_client
+from database.minio import AsyncMinio, get_s3_client
+from database.redis import get_redis_client
+
+from .file import get_download_urls, get_file_object_names
 
 
 router = APIRouter(prefix="/project", tags=["project"])
@@ -70,11 +73,17 @@ async def get_by_id(project: Project = Depends(get_project),
 @router.delete("/{project_id}")
 async def delete(project: Project = Depends(get_project),
                  user: User = Depends(get_project_editor),
+                 minio_client: AsyncMinio = Depends(get_s3_client),
                  redis: Redis = Depends(get_redis_client),
-                 pr: ProjectRepository = Depends(get_project_repo)
+                 pr: ProjectRepository = Depends(get_project_repo),
+                 fr: FileRepository = Depends(get_file_repo)
                  ):
-    await redis.set(f"{RedisType.project_update}:{project.id}", 1, ex=Config.websocket_redis_message_lifetime)
+    await mark_project_updated(redis, project.id)
+    files = await fr.get_by_project(project)
     await pr.delete(project)
+    for file in files:
+        await release_content(redis, minio_client, file.id)
+    await remove_project_archives(minio_client, project.id)
     return {"message": "OK"}
 
 
@@ -85,7 +94,7 @@ async def update(update_data: EditProjectSchema,
                  redis: Redis = Depends(get_redis_client),
                  pr: ProjectRepository = Depends(get_project_repo)
                  ):
-    await redis.set(f"{RedisType.project_update}:{project.id}", 1, ex=Config.websocket_redis_message_lifetime)
+    await mark_project_updated(redis, project.id)
     await pr.update(project,
                     update_data.name,
                     update_data.description)
@@ -95,10 +104,17 @@ async def update(update_data: EditProjectSchema,
 @router.get("/get_all_files/{project_id}")
 async def get_files_from_project(project: Project = Depends(get_project),
                                  user: User = Depends(get_project_viewer),
+                                 size: int | None = None,
+                                 minio_client: AsyncMinio = Depends(get_s3_client),
+                                 redis: Redis = Depends(get_redis_client),
                                  fr: FileRepository = Depends(get_file_repo)
-                                 ) -> list[FileSchema]:
+                                 ) -> list[FileSchema] | list[FileDownloadURLSchema]:
     files = await fr.get_by_project(project)
-    return [FileSchema.from_db(f) for f in files]
+    if size is None:
+        return [FileSchema.from_db(f) for f in files]
+    object_names = await get_file_object_names(redis, files, size)
+    urls = await get_download_urls(redis, minio_client, list(object_names.values()))
+    return [FileDownloadURLSchema.from_db(f, urls[object_names[f.id]]) for f in files]
 
 
 @router.get("/get_active_tasks/{project_id}")
@@ -112,47 +128,32 @@ async def get_active_tasks(project: Project = Depends(get_project),
 @router.get("/download/{project_id}")
 async def download_project(project: Project = Depends(get_project),
                            user: User = Depends(get_project_viewer),
-                           minio_client: Minio = Depends(get_s3_client),
+                           minio_client: AsyncMinio = Depends(get_s3_client),
+                           redis: Redis = Depends(get_redis_client),
                            fr: FileRepository = Depends(get_file_repo)
                            ):
-    images = deepcopy(await fr.get_active_images(project))
-    for image in images:
-        image.file_name = f"images/{image.file_name}"
-    md = ""
-    if project.summary:
-        obj = minio_client.get_object(
-            bucket_name=settings.minio_bucket,
-            object_name=str(project.summary.id),
-        )
-        md = obj.read().decode("utf-8")
-        obj.close()
-        obj.release_conn()
-        for image in images:
-            md = md.replace(str(image.id), image.file_name)
-    if project.transcription:
-        images.append(project.transcription)
-
-    zip_stream = BytesIO()
-    with ZipFile(zip_stream, "w", ZIP_DEFLATED) as zip_file:
-        for image in images:
-            obj = minio_client.get_object(
-                bucket_name=settings.minio_bucket,
-                object_name=str(image.id),
-            )
-            with zip_file.open(image.file_name, "w") as dest_file:
-                shutil.copyfileobj(obj, dest_file, length=obj.fileno())
-            obj.close()
-            obj.release_conn()
-        if project.summary:
-            with zip_file.open(project.summary.file_name, "w") as summary_file:
-                summary_file.write(md.encode("utf-8"))
-
-    zip_stream.seek(0)
+    content_disposition = f'attachment; filename="{project.name}.zip"'
+    version = await get_project_version(redis, project.id)
+    object_name = archive_object_name(project.id, version)
+    try:
+        await minio_client.stat_object(object_name)
+        return RedirectResponse(await minio_client.presigned_get_object(
+            object_name=object_name,
+            expires=timedelta(seconds=Config.minio_url_live_time),
+            response_headers={"response-content-disposition": content_disposition}))
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise MinioException(e.message)
+
+    images = await fr.get_active_images(project)
+    object_names = await get_object_names(redis, [image.id for image in images]
+                                          + [file.id for file in (project.transcription, project.summary) if file])
     return StreamingResponse(
-        zip_stream,
+        store_archive(stream_project_archive(project, images, object_names, version, minio_client),
+                      project.id, version, minio_client, redis),
         media_type="application/zip",
         headers={
-            "Content-Disposition": f'attachment; filename="{project.name}.zip"'}
+            "Content-Disposition": content_disposition}
     )
 
 
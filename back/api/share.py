@@ -1,9 +1,15 @@
 
 
+from uuid import UUID
+
 from deva_p1_db.models import InvitedUser, Project, User
 from deva_p1_db.repositories import InvitedUserRepository
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
+from back.config import Config
 from back.depends import (get_invited_user, get_invited_user_repo,
                           get_not_invited_user, get_project,
                           get_project_by_invited_user, get_project_editor,
@@ -11,6 +17,7 @@ from back.depends import (get_invited_user, get_invited_user_repo,
 from back.exceptions import *
 from back.schemas import UserSchema
 from back.schemas.project import ProjectSchema
+from database.database import session_manager
 
 
 router = APIRouter(prefix="/project/share", tags=["share"])
@@ -43,16 +50,38 @@ async def unshare_project(project: Project = Depends(get_project_by_invited_user
 
 @router.get("/projects/{user_id}")
 async def get_invited_projects(user: User = Depends(get_user_db),
-                               iur: InvitedUserRepository = Depends(
-                                   get_invited_user_repo)
+                               after: UUID | None = None,
+                               limit: int | None = Query(None, ge=1, le=Config.share_page_max_size),
+                               session: AsyncSession = Depends(session_manager.session)
                                ) -> list[ProjectSchema]:
-    return [ProjectSchema.from_db(ir.project) for ir in await iur.get_by_user(user)]
+    """Projects shared with the caller, oldest first. Pass the id of the
+    last project of a page as `after` to get the next one."""
+    query = select(Project) \
+        .join(InvitedUser, InvitedUser.project_id == Project.id) \
+        .where(InvitedUser.user_id == user.id) \
+        .order_by(Project.created_date, Project.id) \
+        .limit(limit)
+    if after is not None:
+        cursor = aliased(Project)
+        query = query.where(tuple_(Project.created_date, Project.id)
+                            > select(cursor.created_date, cursor.id).where(cursor.id == after).scalar_subquery())
+    return [ProjectSchema.from_db(project) for project in (await session.scalars(query))]
 
 
 @router.get("/users/{project_id}")
 async def get_invited_users_list(project: Project = Depends(get_project),
                                  user: User = Depends(get_project_editor),
-                                 iur: InvitedUserRepository = Depends(
-                                     get_invited_user_repo)
+                                 after: str | None = None,
+                                 limit: int | None = Query(None, ge=1, le=Config.share_page_max_size),
+                                 session: AsyncSession = Depends(session_manager.session)
                                  ) -> list[UserSchema]:
-    return [UserSchema.from_db(_.user) for _ in await iur.get_by_project(project)]
+    """Users the project is shared with, ordered by login. Pass the login
+    of the last user of a page as `after` to get the next one."""
+    query = select(User.id, User.login) \
+        .join(InvitedUser, InvitedUser.user_id == User.id) \
+        .where(InvitedUser.project_id == project.id) \
+        .order_by(User.login) \
+        .limit(limit)
+    if after is not None:
+        query = query.where(User.login > after)
+    return [UserSchema(id=row.id, login=row.login) for row in await session.execute(query)]
@@ -6,15 +6,17 @@ from deva_p1_db.enums.task_type import TaskType
 from deva_p1_db.models import Project, User
 from deva_p1_db.repositories import TaskRepository
 from fastapi import APIRouter, Depends
-from faststream.rabbit import RabbitBroker
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from back.broker import get_broker, send_message_and_cache
+from back.active_tasks import get_active_tasks, set_active_task
+from back.broker import dispatch_ready_tasks, mark_dispatched, send_task
 from back.config import Config
 from back.depends import get_project, get_project_editor, get_task_repo
 from back.exceptions import *
+from back.outbox import outbox_relay
 from back.schemas.task import ActiveTaskSchema, TaskCreateSchema
+from back.task_graph import plan_tasks, start_task_graph
 from database.database import session_manager
 from database.redis import RedisType, get_redis_client
 
@@ -25,7 +27,6 @@ router = APIRouter(prefix="/task", tags=["task"])
 async def create_task(new_task: TaskCreateSchema,
                       project: Project = Depends(get_project),
                       user: User = Depends(get_project_editor),
-                      broker: RabbitBroker = Depends(get_broker),
                       redis: Redis = Depends(get_redis_client),
                       tr: TaskRepository = Depends(get_task_repo),
                       session: AsyncSession = Depends(session_manager.session)
@@ -35,16 +36,15 @@ async def create_task(new_task: TaskCreateSchema,
     if new_task.task_type == TaskType.summary.value:
         if len([task for task in await tr.get_by_project(project) if task.done is False]) > 0:
             raise SummaryInTimeWithOtherTasksException()
-    pattern = f"{RedisType.task_cache}:{project.id}:"
-    keys = await redis.keys(f"{pattern}*")
-    if len(keys) > 1:
+    active_types = set(await get_active_tasks(redis, project.id))
+    if len(active_types) > 1:
         raise ProjectAlreadyHasActiveTasksException()
-    if len(keys) == 1:
-        match keys[0]:
-            case val if val == f"{pattern}{TaskType.transcribe.value}":
+    if len(active_types) == 1:
+        match active_types.pop():
+            case TaskType.transcribe.value:
                 if new_task.task_type != TaskType.frames_extract.value:
                     raise OnlyFramesAfterTranscribeAllowedException()
-            case val if val == f"{pattern}{TaskType.frames_extract.value}":
+            case TaskType.frames_extract.value:
                 if new_task.task_type != TaskType.transcribe.value:
                     raise OnlyTranscribeAfterFramesAllowedException()
             case _:
@@ -61,68 +61,66 @@ async def create_task(new_task: TaskCreateSchema,
         case TaskType.summary_edit.value:
             pass  # no-op: nothing to do
         case TaskType.summary.value:
-            if (project.transcription_id is None) \
-                or (
-                (project.frames_extract_done is False)
-                and
-                (resolve_file_type(project.origin_file.file_type).category ==
-                    FileCategory.video.value)
-            ):
-                task_queue = []
-                origin_task = await tr.create(
-                    task_type=TaskType.summary.value,
-                    project=project,
-                    user=user,
-                    prompt=new_task.prompt)
-                if origin_task is None:
-                    raise SendFeedbackToAdminException()
-                if project.transcription_id is None:
-                    transcription_task = await tr.create(
-                        task_type=TaskType.transcribe.value,
-                        project=project, user=user,
-                        prompt=new_task.prompt,
-                        origin_task=origin_task)
-                    if transcription_task is None:
-                        raise SendFeedbackToAdminException()
-                    task_queue.append(transcription_task)
-                if project.frames_extract_done is False and \
-                        resolve_file_type(project.origin_file.file_type).category == FileCategory.video.value:
-                    frames_extract_task = await tr.create(
-                        task_type=TaskType.frames_extract.value,
-                        project=project, user=user,
-                        prompt=new_task.prompt,
-                        origin_task=origin_task)
-                    if frames_extract_task is None:
-                        raise SendFeedbackToAdminException()
-                    task_queue.append(frames_extract_task)
-                summary_task = await tr.create(
-                    task_type=TaskType.summary.value,
-                    project=project,
-                    user=user,
-                    prompt=new_task.prompt,
-                    origin_task=origin_task)
-                if summary_task is None:
-                    raise SendFeedbackToAdminException()
-                await session.commit()
-                for task in task_queue:
-                    await send_message_and_cache(broker, redis, task, project.id)
-                await tr.add_subtask_count(origin_task, len(task_queue) + 1)
-                await redis.set(f"{RedisType.project_task_update}:{project.id}", str(uuid4()), ex=Config.redis_task_status_lifetime)
-                return ActiveTaskSchema.from_db(origin_task)
+            pass  # dependencies are planned below
         case _:
             raise InvalidTaskTypeException()
     task_type = new_task.task_type
     if task_type == TaskType.summary_edit.value:
-        task_type = TaskType.summary.value
+        plan = [TaskType.summary.value]
+    else:
+        plan = plan_tasks(project, task_type)
+    if len(plan) > 1:
+        return await create_task_graph(redis, tr, session, project, user, plan, new_task.prompt)
     task = await tr.create(
-        task_type=task_type,
+        task_type=plan[0],
         project=project,
         user=user,
         prompt=new_task.prompt
     )
     if task is None:
         raise SendFeedbackToAdminException()
+    send_task(session, task)
     await session.commit()
-    await send_message_and_cache(broker, redis, task, project.id)
+    outbox_relay.wake()
+    await set_active_task(redis, task, project.id)
     await redis.set(f"{RedisType.project_task_update}:{project.id}", str(uuid4()), ex=Config.redis_task_status_lifetime)
     return ActiveTaskSchema.from_db(task)
+
+
+async def create_task_graph(redis: Redis,
+                            tr: TaskRepository,
+                            session: AsyncSession,
+                            project: Project,
+                            user: User,
+                            plan: list[str],
+                            prompt: str
+                            ) -> ActiveTaskSchema:
+    """One origin task tracking a subtask per planned step. Steps without
+    pending dependencies start right away, the rest are sent by
+    handle_done_task as their inputs complete."""
+    origin_task = await tr.create(
+        task_type=plan[-1],
+        project=project,
+        user=user,
+        prompt=prompt)
+    if origin_task is None:
+        raise SendFeedbackToAdminException()
+    subtasks = []
+    for task_type in plan:
+        subtask = await tr.create(
+            task_type=task_type,
+            project=project,
+            user=user,
+            prompt=prompt,
+            origin_task=origin_task)
+        if subtask is None:
+            raise SendFeedbackToAdminException()
+        subtasks.append(subtask)
+    await start_task_graph(redis, origin_task.id, subtasks)
+    dispatched = await dispatch_ready_tasks(session, redis, origin_task.id, subtasks, set())
+    await session.commit()
+    outbox_relay.wake()
+    await mark_dispatched(redis, dispatched)
+    await tr.add_subtask_count(origin_task, len(subtasks))
+    await redis.set(f"{RedisType.project_task_update}:{project.id}", str(uuid4()), ex=Config.redis_task_status_lifetime)
+    return ActiveTaskSchema.from_db(origin_task)
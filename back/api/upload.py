@@ -0,0 +1,360 @@
+
+
+import asyncio
+import time
+from datetime import timedelta
+from uuid import UUID, uuid4
+
+from deva_p1_db.enums.file_type import FileCategory, resolve_file_type
+from deva_p1_db.models import File, Project
+from deva_p1_db.repositories import FileRepository, ProjectRepository
+from fastapi import APIRouter, Depends, Request
+from minio import S3Error
+from minio.datatypes import Object
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from back.config import Config
+from back.content_index import is_deduplicated, schedule_deduplication
+from back.depends import (check_project_editor, get_file_repo, get_project,
+                          get_project_editor, get_project_repo,
+                          get_upload_session, get_upload_ticket, get_user)
+from back.exceptions import *
+from back.image_derivatives import schedule_image_derivatives
+from back.project_version import mark_project_updated
+from back.schemas.file import FileSchema
+from back.schemas.upload import (CreateUploadSchema, CreateUploadTicketSchema,
+                                 RedisUploadSessionSchema,
+                                 RedisUploadTicketSchema, UploadSessionSchema,
+                                 UploadTicketSchema)
+from back.schemas.user import UserSchema
+from database.database import session_manager
+from database.minio import (AsyncMinio, UploadLimitExceeded, get_s3_client,
+                            open_s3_client)
+from database.redis import RedisType, get_redis_client
+
+from .file import check_upload_type, link_file_to_project
+
+router = APIRouter(prefix="/file/upload", tags=["file"])
+
+
+async def save_upload_session(redis: Redis, upload_session: RedisUploadSessionSchema) -> None:
+    # the session outlives its expiry score so the cleanup can still abort it
+    await redis.set(f"{RedisType.upload_session}:{upload_session.id}",
+                    upload_session.model_dump_json(),
+                    ex=Config.upload_session_lifetime * 2)
+    await redis.expire(f"{RedisType.upload_session_parts}:{upload_session.id}",
+                       Config.upload_session_lifetime * 2)
+    await redis.zadd(RedisType.upload_session_expiry,
+                     {str(upload_session.id): time.time() + Config.upload_session_lifetime})
+
+
+async def drop_upload_session(redis: Redis, upload_session: RedisUploadSessionSchema) -> None:
+    await redis.delete(f"{RedisType.upload_session}:{upload_session.id}",
+                       f"{RedisType.upload_session_parts}:{upload_session.id}")
+    await redis.zrem(RedisType.upload_session_expiry, str(upload_session.id))
+
+
+async def cleanup_expired_uploads(redis: Redis, minio_client: AsyncMinio) -> None:
+    for upload_session_id in await redis.zrangebyscore(RedisType.upload_session_expiry, 0, time.time()):
+        data = await redis.get(f"{RedisType.upload_session}:{upload_session_id}")
+        if data is None:
+            await redis.zrem(RedisType.upload_session_expiry, upload_session_id)
+            continue
+        upload_session = RedisUploadSessionSchema.model_validate_json(data)
+        try:
+            await minio_client.abort_multipart_upload(upload_session.object_name,
+                                                      upload_session.upload_id)
+        except S3Error:
+            pass
+        try:
+            # completed but never stored, e.g. the store failed and was not retried
+            await minio_client.remove_object(upload_session.object_name)
+        except S3Error:
+            pass
+        await drop_upload_session(redis, upload_session)
+    for ticket_id in await redis.zrangebyscore(RedisType.upload_ticket_expiry, 0, time.time()):
+        try:
+            await minio_client.remove_object(f"uploads/{ticket_id}")
+        except S3Error:
+            pass
+        await redis.delete(f"{RedisType.upload_ticket}:{ticket_id}")
+        await redis.zrem(RedisType.upload_ticket_expiry, ticket_id)
+
+
+async def run_upload_cleanup() -> None:
+    redis = get_redis_client()
+    try:
+        while True:
+            try:
+                await cleanup_expired_uploads(redis, open_s3_client())
+            except (RedisError, S3Error):
+                pass  # retried on the next round
+            await asyncio.sleep(Config.upload_cleanup_interval)
+    finally:
+        await redis.aclose()
+
+
+upload_cleanup_task: asyncio.Task[None] | None = None
+
+
+def open_upload_cleanup() -> None:
+    global upload_cleanup_task
+    if upload_cleanup_task is None:
+        upload_cleanup_task = asyncio.create_task(run_upload_cleanup())
+
+
+async def close_upload_cleanup() -> None:
+    global upload_cleanup_task
+    if upload_cleanup_task is not None:
+        upload_cleanup_task.cancel()
+        try:
+            await upload_cleanup_task
+        except asyncio.CancelledError:
+            pass
+        upload_cleanup_task = None
+
+
+async def stat_uploaded_object(minio_client: AsyncMinio, object_name: str, upload_id: UUID) -> Object:
+    try:
+        return await minio_client.stat_object(object_name)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            raise UploadedObjectNotFoundException(upload_id)
+        raise MinioException(e.message)
+
+
+async def get_received_parts(redis: Redis, upload_session: RedisUploadSessionSchema) -> dict[int, str]:
+    parts = await redis.hgetall(f"{RedisType.upload_session_parts}:{upload_session.id}")
+    return {int(part_number): etag for part_number, etag in parts.items()}
+
+
+async def store_uploaded_object(project: Project,
+                                object_name: str,
+                                file_name: str,
+                                content_type: str,
+                                file_size: int,
+                                minio_client: AsyncMinio,
+                                redis: Redis,
+                                fr: FileRepository,
+                                pr: ProjectRepository,
+                                session: AsyncSession
+                                ) -> File:
+    await mark_project_updated(redis, project.id)
+    file_type = resolve_file_type(content_type)
+
+    db_file = await fr.create(
+        file_name=file_name,
+        file_type=file_type.internal,
+        user=project.holder,
+        file_size=file_size,
+        project=project
+    )
+    if db_file is None:
+        raise SendFeedbackToAdminException()
+
+    # the AI workers read the file by its id
+    stored_name = str(db_file.id)
+    try:
+        await minio_client.move_object(object_name, stored_name)
+    except S3Error as e:
+        await session.rollback()
+        raise MinioException(e.message)
+
+    await link_file_to_project(pr, project, db_file, file_type.category)
+    if is_deduplicated(file_type.category):
+        # hashing means reading the object back, so it stays off the request
+        schedule_deduplication(db_file.id, stored_name)
+    elif file_type.category == FileCategory.image.value:
+        schedule_image_derivatives([stored_name])
+    return db_file
+
+
+async def get_upload_project(project_id: UUID,
+                             user: UserSchema,
+                             file_name: str,
+                             pr: ProjectRepository
+                             ) -> Project:
+    project = await pr.get_by_id(project_id)
+    if project is None:
+        raise ProjectNotFoundException(project_id)
+    check_project_editor(project, user.id)
+    check_upload_type(file_name, project)
+    return project
+
+
+@router.post("/{project_id}")
+async def create_upload(new_upload: CreateUploadSchema,
+                        project: Project = Depends(get_project),
+                        user: UserSchema = Depends(get_project_editor),
+                        minio_client: AsyncMinio = Depends(get_s3_client),
+                        redis: Redis = Depends(get_redis_client)
+                        ) -> UploadSessionSchema:
+    content_type = check_upload_type(new_upload.file_name, project)
+
+    upload_session_id = uuid4()
+    object_name = f"uploads/{upload_session_id}"
+    try:
+        upload_id = await minio_client.create_multipart_upload(object_name, content_type)
+    except S3Error as e:
+        raise MinioException(e.message)
+
+    upload_session = RedisUploadSessionSchema(id=upload_session_id,
+                                              upload_id=upload_id,
+                                              object_name=object_name,
+                                              project_id=project.id,
+                                              user_id=user.id,
+                                              file_name=new_upload.file_name,
+                                              content_type=content_type,
+                                              file_size=new_upload.file_size,
+                                              part_size=Config.upload_part_size)
+    await save_upload_session(redis, upload_session)
+    return UploadSessionSchema.from_redis(upload_session, [])
+
+
+@router.get("/{upload_id}")
+async def get_upload(upload_session: RedisUploadSessionSchema = Depends(get_upload_session),
+                     redis: Redis = Depends(get_redis_client)
+                     ) -> UploadSessionSchema:
+    parts = await get_received_parts(redis, upload_session)
+    return UploadSessionSchema.from_redis(upload_session, list(parts))
+
+
+@router.put("/{upload_id}/{part_number}")
+async def put_upload_part(request: Request,
+                          part_number: int,
+                          upload_session: RedisUploadSessionSchema = Depends(
+                              get_upload_session),
+                          minio_client: AsyncMinio = Depends(get_s3_client),
+                          redis: Redis = Depends(get_redis_client)
+                          ) -> UploadSessionSchema:
+    if part_number < 1 or part_number > upload_session.part_count:
+        raise InvalidUploadPartException(part_number)
+    part_length = upload_session.part_length(part_number)
+    if request.headers.get("content-length", str(part_length)) != str(part_length):
+        raise InvalidUploadPartException(part_number)
+
+    try:
+        etag = await minio_client.upload_part_stream(upload_session.object_name,
+                                                     upload_session.upload_id,
+                                                     part_number,
+                                                     request.stream(),
+                                                     part_length)
+    except UploadLimitExceeded:
+        raise InvalidUploadPartException(part_number)
+    except S3Error as e:
+        raise MinioException(e.message)
+
+    await redis.hset(f"{RedisType.upload_session_parts}:{upload_session.id}", str(part_number), etag)
+    await save_upload_session(redis, upload_session)
+    parts = await get_received_parts(redis, upload_session)
+    return UploadSessionSchema.from_redis(upload_session, list(parts))
+
+
+@router.post("/{upload_id}/complete")
+async def complete_upload(upload_session: RedisUploadSessionSchema = Depends(get_upload_session),
+                          user: UserSchema = Depends(get_user),
+                          minio_client: AsyncMinio = Depends(get_s3_client),
+                          redis: Redis = Depends(get_redis_client),
+                          fr: FileRepository = Depends(get_file_repo),
+                          pr: ProjectRepository = Depends(get_project_repo),
+                          session: AsyncSession = Depends(session_manager.session)
+                          ) -> FileSchema:
+    project = await get_upload_project(upload_session.project_id, user, upload_session.file_name, pr)
+
+    parts = await get_received_parts(redis, upload_session)
+    missing_parts = [n for n in range(1, upload_session.part_count + 1) if n not in parts]
+    if missing_parts:
+        raise UploadIsNotCompleteException(missing_parts)
+
+    try:
+        await minio_client.complete_multipart_upload(upload_session.object_name,
+                                                     upload_session.upload_id,
+                                                     parts)
+    except S3Error as e:
+        # a retry after a failed store finds the upload already completed
+        if e.code != "NoSuchUpload":
+            raise MinioException(e.message)
+        await stat_uploaded_object(minio_client, upload_session.object_name, upload_session.id)
+
+    db_file = await store_uploaded_object(project,
+                                          upload_session.object_name,
+                                          upload_session.file_name,
+                                          upload_session.content_type,
+                                          upload_session.file_size,
+                                          minio_client, redis, fr, pr, session)
+    await drop_upload_session(redis, upload_session)
+    return FileSchema.from_db(db_file)
+
+
+@router.delete("/{upload_id}")
+async def abort_upload(upload_session: RedisUploadSessionSchema = Depends(get_upload_session),
+                       minio_client: AsyncMinio = Depends(get_s3_client),
+                       redis: Redis = Depends(get_redis_client)
+                       ):
+    try:
+        await minio_client.abort_multipart_upload(upload_session.object_name,
+                                                  upload_session.upload_id)
+    except S3Error as e:
+        raise MinioException(e.message)
+    await drop_upload_session(redis, upload_session)
+    return {"message": "OK"}
+
+
+@router.post("/ticket/{project_id}")
+async def create_upload_ticket(new_ticket: CreateUploadTicketSchema,
+                               project: Project = Depends(get_project),
+                               user: UserSchema = Depends(get_project_editor),
+                               minio_client: AsyncMinio = Depends(get_s3_client),
+                               redis: Redis = Depends(get_redis_client)
+                               ) -> UploadTicketSchema:
+    content_type = check_upload_type(new_ticket.file_name, project)
+
+    ticket_id = uuid4()
+    upload_ticket = RedisUploadTicketSchema(id=ticket_id,
+                                            object_name=f"uploads/{ticket_id}",
+                                            project_id=project.id,
+                                            user_id=user.id,
+                                            file_name=new_ticket.file_name,
+                                            content_type=content_type)
+    upload_url = await minio_client.presigned_put_object(
+        object_name=upload_ticket.object_name,
+        expires=timedelta(seconds=Config.upload_ticket_lifetime)
+    )
+    await redis.set(f"{RedisType.upload_ticket}:{ticket_id}",
+                    upload_ticket.model_dump_json(),
+                    ex=Config.upload_ticket_lifetime * 2)
+    await redis.zadd(RedisType.upload_ticket_expiry,
+                     {str(ticket_id): time.time() + Config.upload_ticket_lifetime * 2})
+    return UploadTicketSchema(id=ticket_id,
+                              upload_url=upload_url,
+                              content_type=content_type,
+                              expires_in=Config.upload_ticket_lifetime)
+
+
+@router.post("/ticket/{ticket_id}/complete")
+async def complete_upload_ticket(upload_ticket: RedisUploadTicketSchema = Depends(get_upload_ticket),
+                                 user: UserSchema = Depends(get_user),
+                                 minio_client: AsyncMinio = Depends(get_s3_client),
+                                 redis: Redis = Depends(get_redis_client),
+                                 fr: FileRepository = Depends(get_file_repo),
+                                 pr: ProjectRepository = Depends(get_project_repo),
+                                 session: AsyncSession = Depends(session_manager.session)
+                                 ) -> FileSchema:
+    project = await get_upload_project(upload_ticket.project_id, user, upload_ticket.file_name, pr)
+
+    stat = await stat_uploaded_object(minio_client, upload_ticket.object_name, upload_ticket.id)
+    if stat.size is None or stat.size > Config.upload_max_size:
+        await minio_client.remove_object(upload_ticket.object_name)
+        raise FileTooLargeException(Config.upload_max_size)
+
+    db_file = await store_uploaded_object(project,
+                                          upload_ticket.object_name,
+                                          upload_ticket.file_name,
+                                          upload_ticket.content_type,
+                                          stat.size,
+                                          minio_client, redis, fr, pr, session)
+    await redis.delete(f"{RedisType.upload_ticket}:{upload_ticket.id}")
+    await redis.zrem(RedisType.upload_ticket_expiry, str(upload_ticket.id))
+    return FileSchema.from_db(db_file)
@@ -0,0 +1,211 @@
+
+
+import asyncio
+import mimetypes
+from collections import deque
+from io import BytesIO
+from typing import AsyncGenerator
+from uuid import UUID
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+from deva_p1_db.models import File, Project
+from minio import S3Error
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from back.config import Config
+from back.project_version import get_project_version
+from database.minio import AsyncMinio
+
+COMPRESSED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif"}
+
+
+class ZipStreamBuffer:
+    """Unseekable sink for ZipFile: members are written with data descriptors
+    and the bytes are drained after every member."""
+
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def write_member(zip_file: ZipFile, name: str, data: bytes) -> None:
+    zinfo = ZipInfo(name)
+    zinfo.file_size = len(data)
+    zinfo.compress_type = ZIP_STORED \
+        if mimetypes.guess_type(name)[0] in COMPRESSED_CONTENT_TYPES else ZIP_DEFLATED
+    with zip_file.open(zinfo, "w") as dest_file:
+        dest_file.write(data)
+
+
+def archive_prefix(project_id: UUID) -> str:
+    return f"archives/{project_id}/"
+
+
+def archive_object_name(project_id: UUID, version: int) -> str:
+    return f"{archive_prefix(project_id)}{version}/{project_id}.zip"
+
+
+def summary_object_name(project_id: UUID, version: int) -> str:
+    return f"{archive_prefix(project_id)}{version}/summary.md"
+
+
+async def read_project_summary(project: Project,
+                               names: dict[UUID, str],
+                               object_name: str,
+                               version: int,
+                               minio_client: AsyncMinio
+                               ) -> bytes:
+    derived_name = summary_object_name(project.id, version)
+    try:
+        return await minio_client.read_object(derived_name)
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise
+    md = (await minio_client.read_object(object_name)).decode("utf-8")
+    for file_id, name in names.items():
+        md = md.replace(str(file_id), name)
+    data = md.encode("utf-8")
+    await minio_client.put_object(derived_name, BytesIO(data), len(data), content_type="text/markdown")
+    return data
+
+
+async def remove_project_archives(minio_client: AsyncMinio,
+                                  project_id: UUID,
+                                  below_version: int | None = None
+                                  ) -> None:
+    """Removes the derived objects of every version, or only of the versions
+    older than below_version, so a late download never drops a newer one."""
+    prefix = archive_prefix(project_id)
+    for name in await minio_client.list_objects(prefix):
+        version = name[len(prefix):].split("/", 1)[0]
+        if below_version is None or (version.isdigit() and int(version) < below_version):
+            await minio_client.remove_object(name)
+
+
+async def is_current_version(redis: Redis, project_id: UUID, version: int) -> bool:
+    try:
+        return await get_project_version(redis, project_id) == version
+    except RedisError:
+        return False
+
+
+async def store_archive(chunks: AsyncGenerator[bytes, None],
+                        project_id: UUID,
+                        version: int,
+                        minio_client: AsyncMinio,
+                        redis: Redis
+                        ) -> AsyncGenerator[bytes, None]:
+    """Passes the archive through while uploading it as a multipart object,
+    then drops the derived objects of older versions. An archive whose
+    project changed while it was streamed is not stored. Caching is best
+    effort: a storage error stops the upload but never the download."""
+    object_name = archive_object_name(project_id, version)
+    upload_id: str | None
+    try:
+        upload_id = await minio_client.create_multipart_upload(object_name, "application/zip")
+    except S3Error:
+        upload_id = None
+    etags: dict[int, str] = {}
+    part = bytearray()
+    completed = False
+
+    async def upload_part() -> None:
+        if upload_id is None:
+            return
+        try:
+            etags[len(etags) + 1] = await minio_client.upload_part(
+                object_name, upload_id, len(etags) + 1, bytes(part))
+        except S3Error:
+            await abort_upload()
+        part.clear()
+
+    async def abort_upload() -> None:
+        nonlocal upload_id
+        if upload_id is None:
+            return
+        try:
+            await minio_client.abort_multipart_upload(object_name, upload_id)
+        except S3Error:
+            pass
+        upload_id = None
+
+    try:
+        async for chunk in chunks:
+            yield chunk
+            if upload_id is None:
+                continue
+            part += chunk
+            if len(part) >= Config.upload_part_size:
+                await upload_part()
+        if upload_id is not None and (part or not etags):
+            await upload_part()
+        if upload_id is not None and await is_current_version(redis, project_id, version):
+            try:
+                await minio_client.complete_multipart_upload(object_name, upload_id, etags)
+                completed = True
+            except S3Error:
+                pass
+    finally:
+        await chunks.aclose()
+        if not completed:
+            await abort_upload()
+
+    if completed:
+        try:
+            await remove_project_archives(minio_client, project_id, below_version=version)
+        except S3Error:
+            pass  # retried after the next archive is stored
+
+
+async def stream_project_archive(project: Project,
+                                 images: list[File],
+                                 object_names: dict[UUID, str],
+                                 version: int,
+                                 minio_client: AsyncMinio
+                                 ) -> AsyncGenerator[bytes, None]:
+    names: dict[UUID, str] = {image.id: f"images/{image.file_name}" for image in images}
+    members: list[tuple[str, str]] = [(names[image.id], object_names[image.id]) for image in images]
+    if project.transcription:
+        members.append((project.transcription.file_name, object_names[project.transcription.id]))
+
+    summary = None
+    if project.summary:
+        summary = (project.summary.file_name,
+                   asyncio.create_task(read_project_summary(project, names, object_names[project.summary.id],
+                                                           version, minio_client)))
+
+    pending: deque[asyncio.Task[bytes]] = deque()
+    buffer = ZipStreamBuffer()
+    zip_file = ZipFile(buffer, "w", ZIP_DEFLATED)  # type: ignore
+    try:
+        for index, (name, _) in enumerate(members):
+            while len(pending) < Config.archive_prefetch and index + len(pending) < len(members):
+                pending.append(asyncio.create_task(
+                    minio_client.read_object(members[index + len(pending)][1])))
+            data = await pending.popleft()
+            await asyncio.to_thread(write_member, zip_file, name, data)
+            yield buffer.drain()
+
+        if summary is not None:
+            summary_name, summary_task = summary
+            await asyncio.to_thread(write_member, zip_file, summary_name, await summary_task)
+
+        await asyncio.to_thread(zip_file.close)
+        yield buffer.drain()
+    finally:
+        for task in pending:
+            task.cancel()
+        if summary is not None:
+            summary[1].cancel()
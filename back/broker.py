@@ -5,16 +5,25 @@ from uuid import UUID
 from deva_p1_db.enums.rabbit import RabbitQueuesToBack
 from deva_p1_db.enums.task_type import TaskType
 from deva_p1_db.models import Task
-from deva_p1_db.repositories import TaskRepository
+from deva_p1_db.repositories import (FileRepository, ProjectRepository,
+                                     TaskRepository)
 from deva_p1_db.schemas.task import (TaskErrorToBack, TaskReadyToBack,
                                      TaskStatusToBack, TaskToAi)
 from fastapi import Depends
-from faststream.rabbit import RabbitBroker, RabbitQueue, fastapi
+from faststream.rabbit import Channel, RabbitBroker, RabbitQueue, fastapi
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from back.active_tasks import drop_active_tasks, set_active_task
 from back.config import Config
-from back.schemas.task import RedisTaskCacheSchema
+from back.consumers import progress_consumers, task_consumers
+from back.content_index import get_object_names
+from back.image_derivatives import schedule_image_derivatives
+from back.outbox import enqueue_message, outbox_relay
+from back.progress import progress_coalescer
+from back.project_version import bump_project_version
+from back.task_graph import (claim_dispatch, ready_tasks,
+                             record_graph_progress)
 from config import settings
 from database.database import session_manager
 from database.redis import RedisType, get_redis_client
@@ -24,70 +33,135 @@ RABBIT_URL = f"amqp://{settings.rabbit_user}:{settings.rabbit_password}@{setting
 router = fastapi.RabbitRouter(RABBIT_URL)
 
 
-async def send_message_and_cache(broker: RabbitBroker, redis: Redis, task: Task, project_id: UUID):
-    await send_message(broker, f"{task.task_type}_task", TaskToAi(task_id=task.id))
-    await redis.set(f"{RedisType.task_cache}:{project_id}:{task.task_type}", RedisTaskCacheSchema.from_db(
-        task).model_dump_json(), ex=Config.redis_task_status_lifetime)
+def send_task(session: AsyncSession, task: Task) -> None:
+    """Queues the task for the AI in the outbox, commit the session to send
+    it. Mark it active only after that commit, a rolled back task would
+    otherwise block its project."""
+    enqueue_message(session, f"{task.task_type}_task", TaskToAi(task_id=task.id))
+
+
+async def dispatch_ready_tasks(session: AsyncSession,
+                               redis: Redis,
+                               origin_id: UUID,
+                               subtasks: list[Task],
+                               done_ids: set[UUID]
+                               ) -> list[Task]:
+    """Queues every subtask whose dependencies are done, commit the session
+    to send them and pass the returned tasks to mark_dispatched."""
+    ready = [task for task in ready_tasks(subtasks, done_ids)
+             if await claim_dispatch(redis, origin_id, task.id)]
+    for task in ready:
+        send_task(session, task)
+    return ready
+
+
+async def mark_dispatched(redis: Redis, tasks: list[Task]) -> None:
+    for task in tasks:
+        await set_active_task(redis, task, task.project_id)
+        await redis.set(f"{RedisType.task_status}:{task.id}", 0.0, ex=Config.redis_task_status_lifetime)
 
 
 def get_broker() -> RabbitBroker:
     return router.broker
 
 
+@router.after_startup
+async def start_outbox_relay(app):
+    outbox_relay.start(router.broker)
+
+
+@router.on_broker_shutdown
+async def stop_outbox_relay(app):
+    await outbox_relay.stop()
+
+
+@router.on_broker_shutdown
+async def flush_progress(app):
+    await progress_coalescer.close()
+
+
 async def send_message(broker: RabbitBroker, queue: RabbitQueue | str, data: TaskToAi | dict):
     await broker.publish(data, queue)
 
 
-@router.subscriber(RabbitQueuesToBack.done_task)  # TODO: fix origin task
+def back_queue(name: str) -> RabbitQueue:
+    # only one replica consumes a queue at a time, so deliveries reach the
+    # handlers in publish order; the others take over when it goes away
+    return RabbitQueue(name, arguments={"x-single-active-consumer": True})
+
+
+@router.subscriber(back_queue(RabbitQueuesToBack.done_task),  # TODO: fix origin task
+                   channel=Channel(prefetch_count=settings.broker_prefetch),
+                   middlewares=[task_consumers.middleware("done_task")])
 async def handle_done_task(msg: TaskReadyToBack,
+                           message: fastapi.RabbitMessage,
                            session: AsyncSession = Depends(
                                session_manager.session),
                            broker: RabbitBroker = Depends(get_broker),
                            redis: Redis = Depends(get_redis_client)
                            ):
+    slot = task_consumers.slot(message)
+    await progress_coalescer.discard(msg.task_id)
     tr = TaskRepository(session)
     handled_task = await tr.get_by_id(msg.task_id)
     if handled_task is None:
         raise Exception("got incorrect task id from ai")
+    await slot.claim_project(redis, handled_task.project_id)
 
     if handled_task.origin_task_id is not None:
-        if handled_task.task_type == TaskType.frames_extract.value or handled_task.task_type == TaskType.transcribe.value:
-            origin_task = await tr.get_by_id(handled_task.origin_task_id)
-            if origin_task is None:
-                raise Exception("logic error")
-            tasks = [task for task in (await tr.get_by_origin_task(origin_task)) if task.done is False]
-            if len(tasks) == 1:
-                await send_message_and_cache(broker, redis, tasks[0], handled_task.project_id)
-                await redis.set(f"{RedisType.task_status}:{tasks[0].id}", 0.0, ex=Config.redis_task_status_lifetime)
-        if handled_task.task_type == TaskType.summary.value:
-            origin_task = await tr.get_by_id(handled_task.origin_task_id)
-            if origin_task is None:
-                raise Exception("logic error")
+        origin_task = await tr.get_by_id(handled_task.origin_task_id)
+        if origin_task is None:
+            raise Exception("logic error")
+        subtasks = await tr.get_by_origin_task(origin_task)
+        done_ids = {task.id for task in subtasks if task.done} | {handled_task.id}
+        await record_graph_progress(redis, {handled_task.id: 1.0})
+        if all(task.id in done_ids for task in subtasks):
             await tr.task_done(origin_task)
-            
-    await redis.delete(f"{RedisType.task_cache}:{handled_task.project_id}:{handled_task.task_type}")
+        else:
+            dispatched = await dispatch_ready_tasks(session, redis, origin_task.id, subtasks, done_ids)
+            await session.commit()
+            outbox_relay.wake()
+            await mark_dispatched(redis, dispatched)
+
+    await drop_active_tasks(redis, handled_task.project_id, [handled_task.task_type])
     await redis.set(f"{RedisType.task_done}:{msg.task_id}", 1, ex=Config.redis_task_status_lifetime)
+    await bump_project_version(redis, handled_task.project_id)
+
+    if handled_task.task_type == TaskType.frames_extract.value:
+        project = await ProjectRepository(session).get_by_id(handled_task.project_id)
+        if project is not None:
+            images = await FileRepository(session).get_active_images(project)
+            object_names = await get_object_names(redis, [image.id for image in images])
+            schedule_image_derivatives(list(object_names.values()))
 
 
-@router.subscriber(RabbitQueuesToBack.progress_task)
+@router.subscriber(back_queue(RabbitQueuesToBack.progress_task),
+                   channel=Channel(prefetch_count=settings.broker_prefetch),
+                   middlewares=[progress_consumers.middleware("progress_task")])
 async def handle_progress_task(msg: TaskStatusToBack,
+                               message: fastapi.RabbitMessage,
                                redis: Redis = Depends(get_redis_client)
                                ):
-    await redis.set(f"{RedisType.task_status}:{msg.task_id}",
-                    msg.progress,
-                    ex=Config.redis_task_status_lifetime)
+    await progress_consumers.slot(message).wait_turn(msg.task_id)
+    await progress_coalescer.update(redis, msg.task_id, msg.progress)
 
 
-@router.subscriber(RabbitQueuesToBack.error_task)
+@router.subscriber(back_queue(RabbitQueuesToBack.error_task),
+                   channel=Channel(prefetch_count=settings.broker_prefetch),
+                   middlewares=[task_consumers.middleware("error_task")])
 async def handle_error_task(msg: TaskErrorToBack,
+                            message: fastapi.RabbitMessage,
                             session: AsyncSession = Depends(
                                 session_manager.session),
                             redis: Redis = Depends(get_redis_client)
                             ):
+    slot = task_consumers.slot(message)
+    await progress_coalescer.discard(msg.task_id)
     tr = TaskRepository(session)
     handled_task = await tr.get_by_id(msg.task_id)
     if handled_task is None:
         raise Exception("got incorrect task id from ai")
+    await slot.claim_project(redis, handled_task.project_id)
     await tr.task_done(handled_task)
     if handled_task.origin_task_id is not None:
         origin_task = await tr.get_by_id(handled_task.origin_task_id)
@@ -96,6 +170,8 @@ async def handle_error_task(msg: TaskErrorToBack,
         tasks = await tr.get_by_origin_task(origin_task)
         for task in tasks:
             await tr.task_done(task)
-            await redis.delete(f"{RedisType.task_cache}:{task.project_id}:{task.task_type}")
+        await drop_active_tasks(redis, handled_task.project_id, [task.task_type for task in tasks])
         await tr.task_done(origin_task)
+    else:
+        await drop_active_tasks(redis, handled_task.project_id, [handled_task.task_type])
     await redis.set(f"{RedisType.task_error}:{handled_task.id}", msg.error, ex=Config.redis_task_status_lifetime)
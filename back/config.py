@@ -10,12 +10,44 @@ SECRET = settings.secret
 class Config:
 	access_token_lifetime = 60 * 10
 	refresh_token_lifetime = 3600 * 24 * 30
+	access_token_cache_size = 10000
+	user_cache_size = 10000
+	user_cache_local_lifetime = 30
+	user_cache_lifetime = 60 * 10
 	login_gap = 20
+	login_attempts = 5
+	password_workers = 2
+	password_max_pending = 32
+	password_retry_after = 1
 	ip_buffer = 10
 	ip_buffer_lifetime = 60*60*24
+	register_attempts = 10
+	register_attempts_lifetime = 60 * 60
 	algorithm = "HS256"
 	websocket_redis_message_lifetime = 60 * 60
 	websocket_polling_interval = 1
 	websocket_max_iterations = 60 * 60 / websocket_polling_interval
 	redis_task_status_lifetime = 60 * 10
-	minio_url_live_time = 10*60
\ No newline at end of file
+	task_graph_lifetime = 60 * 60 * 24
+	progress_flush_interval = 0.5
+	progress_tracked_size = 100000
+	outbox_batch_size = 100
+	broker_project_lock_timeout = 60
+	outbox_interval = 1
+	outbox_retention = 60 * 60 * 24
+	minio_url_live_time = 10*60
+	minio_url_refresh_gap = 60
+	upload_part_size = 10 * 1024 * 1024
+	upload_parallel_parts = 3
+	upload_max_size = 8 * 1024 * 1024 * 1024
+	upload_session_lifetime = 60 * 60 * 24
+	upload_ticket_lifetime = 60 * 60
+	upload_cleanup_interval = 60 * 10
+	file_meta_lifetime = 60 * 10
+	content_lock_timeout = 60 * 5
+	content_hash_workers = 2
+	archive_prefetch = 8
+	share_page_max_size = 500
+	image_derivative_widths = (320, 1280)
+	image_derivative_quality = 80
+	image_derivative_workers = 2
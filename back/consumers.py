@@ -0,0 +1,148 @@
+
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
+from uuid import UUID
+
+from faststream.rabbit.message import RabbitMessage
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+
+from back.config import Config
+from config import settings
+from database.redis import RedisType
+
+Handler = Callable[[RabbitMessage], Awaitable[Any]]
+
+
+class ConsumerSlot:
+    """One message being handled. Its key, the project or task it belongs
+    to, is unknown until the handler has parsed it and calls wait_turn or
+    claim_project."""
+
+    def __init__(self, group: "ConsumerGroup") -> None:
+        self.group = group
+        self.key: UUID | None = None
+        self.resolved = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.lock: Any = None
+
+    async def claim_project(self, redis: Redis, project_id: UUID) -> None:
+        """Waits for every earlier message of the same project in this worker.
+
+        Order across replicas comes from the queues having a single active
+        consumer, so one worker sees every delivery of a queue. The redis
+        lock only adds mutual exclusion, for the moment a new active
+        consumer takes over while the old one still finishes its handlers;
+        it does not order those two workers' messages."""
+        started = time.perf_counter()
+        await self.wait_turn(project_id)
+        self.lock = redis.lock(f"{RedisType.project_consumer_lock}:{project_id}",
+                               timeout=Config.broker_project_lock_timeout)
+        await self.lock.acquire()
+        self.group.waited += time.perf_counter() - started
+
+    async def wait_turn(self, key: UUID) -> None:
+        """Waits until every earlier message with the same key in this worker
+        has been handled."""
+        self.key = key
+        self.resolved.set()
+        slots = self.group.slots
+        for earlier in slots[:slots.index(self)]:
+            await earlier.resolved.wait()
+            if earlier.key == key:
+                await earlier.finished.wait()
+
+    async def release(self) -> None:
+        if self.lock is not None:
+            try:
+                await self.lock.release()
+            except LockError:
+                pass  # held longer than broker_project_lock_timeout, already expired
+            self.lock = None
+        self.resolved.set()
+        self.finished.set()
+        if self in self.group.slots:
+            self.group.slots.remove(self)
+
+
+class ConsumerGroup:
+    """Runs broker handlers concurrently while keeping the messages of one
+    project in delivery order.
+
+    The subscriber middleware queues a slot and takes a semaphore permit
+    before FastAPI resolves the handler's dependencies, some of which run on
+    the thread pool and would let later deliveries overtake earlier ones.
+    Nothing yields to the event loop in between, so slots and permits follow
+    delivery order, and a handler holding a permit only ever waits for
+    earlier handlers, which hold permits themselves."""
+
+    def __init__(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.slots: list[ConsumerSlot] = []
+        self.queued: dict[int, ConsumerSlot] = {}
+        self.waited = 0.0
+        self.timings: dict[str, dict[str, float]] = {}
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": len(self.slots),
+            "ordering_wait_seconds": self.waited,
+            "handlers": {
+                name: {**timing,
+                       "avg_seconds": timing["total_seconds"] / timing["count"],
+                       "avg_lag_seconds": timing["total_lag_seconds"] / timing["count"]}
+                for name, timing in self.timings.items()
+            },
+        }
+
+    def record(self, name: str, seconds: float, lag: float, failed: bool) -> None:
+        timing = self.timings.setdefault(name, {"count": 0, "failed": 0,
+                                                "total_seconds": 0.0, "max_seconds": 0.0,
+                                                "total_lag_seconds": 0.0, "max_lag_seconds": 0.0})
+        timing["count"] += 1
+        timing["failed"] += failed
+        timing["total_seconds"] += seconds
+        timing["max_seconds"] = max(timing["max_seconds"], seconds)
+        timing["total_lag_seconds"] += lag
+        timing["max_lag_seconds"] = max(timing["max_lag_seconds"], lag)
+
+    def middleware(self, name: str) -> Callable[[Handler, RabbitMessage], Awaitable[Any]]:
+        """Subscriber middleware that runs the handler inside a slot. Lag is
+        measured from the publish timestamp, which AMQP only carries with
+        second precision."""
+        async def consume(call_next: Handler, message: RabbitMessage) -> Any:
+            slot = ConsumerSlot(self)
+            self.slots.append(slot)
+            self.queued[id(message)] = slot
+            published = message.raw_message.timestamp
+            lag = 0.0
+            if published is not None:
+                if published.tzinfo is None:
+                    published = published.replace(tzinfo=timezone.utc)
+                lag = max((datetime.now(timezone.utc) - published).total_seconds(), 0.0)
+            started = time.perf_counter()
+            failed = True
+            try:
+                async with self.semaphore:
+                    result = await call_next(message)
+                failed = False
+                return result
+            finally:
+                del self.queued[id(message)]
+                await slot.release()
+                self.record(name, time.perf_counter() - started, lag, failed)
+        return consume
+
+    def slot(self, message: RabbitMessage) -> ConsumerSlot:
+        """The slot the middleware queued for the message being handled."""
+        return self.queued[id(message)]
+
+
+task_consumers = ConsumerGroup(settings.broker_concurrency)
+# progress is ordered per task and never takes the project lock
+progress_consumers = ConsumerGroup(settings.broker_concurrency)
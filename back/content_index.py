@@ -0,0 +1,152 @@
+
+import asyncio
+import hashlib
+from uuid import UUID
+
+from deva_p1_db.enums.file_type import FileCategory
+from minio import S3Error
+from redis.asyncio import Redis
+from redis.asyncio.lock import Lock
+
+from back.config import Config
+from back.image_derivatives import (remove_image_derivatives,
+                                    schedule_image_derivatives)
+from database.minio import AsyncMinio, open_s3_client
+from database.redis import RedisType, get_redis_client, register_script
+
+# KEYS: reference counter of the object, content_blob, content_digest
+# ARGV: digest, object name
+# Returns 1 when the last reference was dropped and the object unindexed.
+RELEASE_SCRIPT = register_script("""
+if redis.call('DECR', KEYS[1]) > 0 then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+redis.call('HDEL', KEYS[3], ARGV[2])
+return 1
+""")
+
+# The AI workers open origin media, transcripts and summaries by file id, so
+# only images, which they never read, may point at another file's object.
+DEDUPLICATED_CATEGORIES = (FileCategory.image.value,)
+
+dedup_tasks: dict[UUID, asyncio.Task[None]] = {}
+dedup_slots = asyncio.Semaphore(Config.content_hash_workers)
+
+
+def is_deduplicated(file_category: str) -> bool:
+    return file_category in DEDUPLICATED_CATEGORIES
+
+
+def content_lock(redis: Redis, digest: str) -> Lock:
+    # held while a digest is pointed at an object or the object removed, so a
+    # release can't delete the bytes a concurrent store has just counted on
+    return redis.lock(f"{RedisType.content_lock}:{digest}", timeout=Config.content_lock_timeout)
+
+
+async def get_object_name(redis: Redis, file_id: UUID) -> str:
+    # files that were never deduplicated keep living under their own id
+    return await redis.hget(RedisType.file_object, str(file_id)) or str(file_id)  # type: ignore
+
+
+async def get_object_names(redis: Redis, file_ids: list[UUID]) -> dict[UUID, str]:
+    if not file_ids:
+        return {}
+    names = await redis.hmget(RedisType.file_object, [str(file_id) for file_id in file_ids])  # type: ignore
+    return {file_id: name or str(file_id) for file_id, name in zip(file_ids, names)}
+
+
+async def hash_object(minio_client: AsyncMinio, object_name: str) -> str:
+    """SHA-256 of an object uploaded without passing through the backend."""
+    sha256 = hashlib.sha256()
+    async for chunk in await minio_client.get_object(object_name):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+async def store_content(redis: Redis,
+                        minio_client: AsyncMinio,
+                        file_id: UUID,
+                        digest: str,
+                        object_name: str
+                        ) -> str:
+    """Points the file at the object already holding the bytes with the given
+    SHA-256. The file's own object, stored under object_name, is removed if
+    there is one, and otherwise becomes that object itself, so nothing is
+    ever copied."""
+    stored = await redis.hget(RedisType.file_object, str(file_id))  # type: ignore
+    if stored is not None:
+        return stored
+    async with content_lock(redis, digest):
+        blob = await redis.hget(RedisType.content_blob, digest)  # type: ignore
+        if blob is not None and blob != object_name:
+            try:
+                await minio_client.stat_object(blob)
+            except S3Error as e:
+                if e.code != "NoSuchKey":
+                    raise
+                await redis.delete(f"{RedisType.content_refs}:{blob}")
+                await redis.hdel(RedisType.content_digest, blob)  # type: ignore
+                blob = None
+        if blob is None:
+            blob = object_name
+            await redis.hset(RedisType.content_blob, digest, blob)  # type: ignore
+            await redis.hset(RedisType.content_digest, blob, digest)  # type: ignore
+        await redis.incr(f"{RedisType.content_refs}:{blob}")
+        await redis.hset(RedisType.file_object, str(file_id), blob)  # type: ignore
+    if blob != object_name:
+        await minio_client.remove_object(object_name)
+        # built if the file was viewed before it was deduplicated
+        await remove_image_derivatives(redis, minio_client, object_name)
+    return blob
+
+
+async def deduplicate_object(file_id: UUID, object_name: str) -> None:
+    """Hashes an image uploaded straight to storage and stores it in the
+    content index, then builds its derivatives."""
+    minio_client = open_s3_client()
+    redis = get_redis_client()
+    try:
+        async with dedup_slots:
+            digest = await hash_object(minio_client, object_name)
+            stored_name = await store_content(redis, minio_client, file_id, digest, object_name)
+        schedule_image_derivatives([stored_name])
+    except S3Error:
+        # left under its own object, the file just isn't shared
+        schedule_image_derivatives([object_name])
+    finally:
+        dedup_tasks.pop(file_id, None)
+        await redis.aclose()
+
+
+def schedule_deduplication(file_id: UUID, object_name: str) -> None:
+    if file_id not in dedup_tasks:
+        dedup_tasks[file_id] = asyncio.create_task(deduplicate_object(file_id, object_name))
+
+
+async def close_deduplication() -> None:
+    tasks = list(dedup_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def release_content(redis: Redis, minio_client: AsyncMinio, file_id: UUID) -> None:
+    object_name = await redis.hget(RedisType.file_object, str(file_id))  # type: ignore
+    if object_name is None:
+        return
+    await redis.hdel(RedisType.file_object, str(file_id))  # type: ignore
+    digest = await redis.hget(RedisType.content_digest, object_name)  # type: ignore
+    if digest is None:
+        return
+    async with content_lock(redis, digest):
+        if await RELEASE_SCRIPT(keys=[f"{RedisType.content_refs}:{object_name}",
+                                      RedisType.content_blob,
+                                      RedisType.content_digest],
+                                args=[digest, object_name],
+                                client=redis):
+            await minio_client.remove_object(object_name)
+            await remove_image_derivatives(redis, minio_client, object_name)
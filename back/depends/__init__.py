@@ -2,9 +2,14 @@
 
 from .database import (get_file_repo, get_invited_user_repo, get_note_repo,
                        get_project_repo, get_task_repo, get_user_repo)
-from .get_file import get_file, get_file_editor, get_file_viewer
+from .get_context import (AccessContext, get_file_context, get_note_context,
+                          get_project_context)
+from .get_file import (get_file, get_file_editor, get_file_meta,
+                       get_file_viewer, invalidate_file_meta)
 from .get_note import get_note, get_note_editor, get_note_viewer
-from .get_project import (get_project, get_project_by_invited_user,
-                          get_project_editor, get_project_viewer)
+from .get_project import (check_project_editor, get_project,
+                          get_project_by_invited_user, get_project_editor,
+                          get_project_viewer)
+from .get_upload import get_upload_session, get_upload_ticket
 from .get_user import (get_invited_user, get_not_invited_user, get_user,
                        get_user_db)
@@ -1,11 +1,12 @@
 
 from deva_p1_db.repositories import (FileRepository, InvitedUserRepository,
                                      NoteRepository, ProjectRepository,
-                                     TaskRepository, UserRepository)
+                                     TaskRepository)
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.database import session_manager
+from database.user_repository import UserRepository
 
 
 async def get_user_repo(session: AsyncSession = Depends(session_manager.session)
@@ -0,0 +1,91 @@
+
+from uuid import UUID
+
+from deva_p1_db.models import File, InvitedUser, Note, Project, User
+from fastapi import Depends
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+
+from back.exceptions import (FileNotFoundException, NoteNotFoundException,
+                             ProjectNotFoundException)
+from database.database import session_manager
+
+from .get_user import get_user_db
+
+
+class AccessContext:
+    """What the caller may do with the project a request targets, together
+    with the rows on the way to it. FastAPI caches dependencies per request,
+    so every get_*_viewer / get_*_editor of one request shares a context."""
+
+    def __init__(self,
+                 user: User,
+                 project: Project,
+                 is_member: bool,
+                 file: File | None = None,
+                 note: Note | None = None
+                 ) -> None:
+        self.user = user
+        self.project = project
+        self.is_member = is_member
+        self.file = file
+        self.note = note
+
+    @property
+    def is_holder(self) -> bool:
+        return self.user.id == self.project.holder_id
+
+    @property
+    def can_view(self) -> bool:
+        return self.is_holder or self.is_member
+
+    @property
+    def can_edit(self) -> bool:
+        return self.is_holder
+
+
+def join_membership(query, user: User):
+    return query.outerjoin(InvitedUser, and_(InvitedUser.project_id == Project.id,
+                                             InvitedUser.user_id == user.id))
+
+
+async def get_project_context(project_id: UUID,
+                              user: User = Depends(get_user_db),
+                              session: AsyncSession = Depends(session_manager.session)
+                              ) -> AccessContext:
+    query = join_membership(select(Project, InvitedUser.user_id), user) \
+        .where(Project.id == project_id)
+    row = (await session.execute(query)).first()
+    if row is None:
+        raise ProjectNotFoundException(project_id)
+    project, member_id = row
+    return AccessContext(user, project, member_id is not None)
+
+
+async def get_file_context(file_id: UUID,
+                           user: User = Depends(get_user_db),
+                           session: AsyncSession = Depends(session_manager.session)
+                           ) -> AccessContext:
+    query = join_membership(select(File, InvitedUser.user_id).join(File.project), user) \
+        .options(contains_eager(File.project)) \
+        .where(File.id == file_id)
+    row = (await session.execute(query)).first()
+    if row is None:
+        raise FileNotFoundException(file_id)
+    file, member_id = row
+    return AccessContext(user, file.project, member_id is not None, file=file)
+
+
+async def get_note_context(note_id: UUID,
+                           user: User = Depends(get_user_db),
+                           session: AsyncSession = Depends(session_manager.session)
+                           ) -> AccessContext:
+    query = join_membership(select(Note, InvitedUser.user_id).join(Note.file).join(File.project), user) \
+        .options(contains_eager(Note.file).contains_eager(File.project)) \
+        .where(Note.id == note_id)
+    row = (await session.execute(query)).first()
+    if row is None:
+        raise NoteNotFoundException(note_id)
+    note, member_id = row
+    return AccessContext(user, note.file.project, member_id is not None, file=note.file, note=note)
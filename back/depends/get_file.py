@@ -1,35 +1,72 @@
 
 
+import mimetypes
+from datetime import UTC
 from uuid import UUID
 
 from deva_p1_db.models import File, User
-from deva_p1_db.repositories import FileRepository, InvitedUserRepository
 from fastapi import Depends
+from minio import S3Error
+from redis.asyncio import Redis
 
-from back.exceptions import FileNotFoundException
+from back.config import Config
+from back.content_index import get_object_name
+from back.exceptions import (FileNotFoundException, MinioException,
+                             PermissionDeniedException)
+from back.schemas.file import FileMetaSchema
+from database.minio import AsyncMinio, get_s3_client
+from database.redis import RedisType, get_redis_client
 
-from .database import get_file_repo, get_invited_user_repo
-from .get_project import get_project_editor, get_project_viewer
-from .get_user import get_user_db
+from .get_context import AccessContext, get_file_context
 
 
-async def get_file(file_id: UUID,
-                   fr: FileRepository = Depends(get_file_repo)
-                   ) -> File:
-    file = await fr.get_by_id(file_id)
-    if file is None:
-        raise FileNotFoundException(file_id)
-    return file
+async def get_file(context: AccessContext = Depends(get_file_context)) -> File:
+    return context.file  # type: ignore
 
 
-async def get_file_viewer(file: File = Depends(get_file),
-                          user: User = Depends(get_user_db),
-                          iur: InvitedUserRepository = Depends(get_invited_user_repo)
-                          ) -> User:
-    return await get_project_viewer(file.project, user, iur)
+async def get_file_viewer(context: AccessContext = Depends(get_file_context)) -> User:
+    if not context.can_view:
+        raise PermissionDeniedException()
+    return context.user
 
 
-async def get_file_editor(file: File = Depends(get_file),
-                          user: User = Depends(get_user_db)
-                          ) -> User:
-    return await get_project_editor(file.project, user)
+async def get_file_editor(context: AccessContext = Depends(get_file_context)) -> User:
+    if not context.can_edit:
+        raise PermissionDeniedException()
+    return context.user
+
+
+async def get_file_meta(file: File = Depends(get_file),
+                        minio_client: AsyncMinio = Depends(get_s3_client),
+                        redis: Redis = Depends(get_redis_client)
+                        ) -> FileMetaSchema:
+    version = file.last_modified_date.isoformat()
+    cached = await redis.get(f"{RedisType.file_meta}:{file.id}")
+    if cached is not None:
+        meta = FileMetaSchema.model_validate_json(cached)
+        if meta.version == version:
+            return meta
+    object_name = await get_object_name(redis, file.id)
+    try:
+        stat = await minio_client.stat_object(object_name)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            raise FileNotFoundException(file.id)
+        raise MinioException(e.message)
+    if stat.size is None:
+        raise FileNotFoundException(file.id)
+    row_modified = file.last_modified_date.replace(tzinfo=UTC)
+    meta = FileMetaSchema(object_name=object_name,
+                          size=stat.size,
+                          etag=stat.etag or "",
+                          content_type=stat.content_type
+                          or mimetypes.guess_type(file.file_name)[0]
+                          or "application/octet-stream",
+                          last_modified=max(stat.last_modified or row_modified, row_modified),
+                          version=version)
+    await redis.set(f"{RedisType.file_meta}:{file.id}", meta.model_dump_json(), ex=Config.file_meta_lifetime)
+    return meta
+
+
+async def invalidate_file_meta(redis: Redis, file_id: UUID) -> None:
+    await redis.delete(f"{RedisType.file_meta}:{file_id}")
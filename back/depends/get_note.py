@@ -1,36 +1,23 @@
 
-from uuid import UUID
-
 from deva_p1_db.models import Note, User
-from deva_p1_db.repositories import InvitedUserRepository, NoteRepository
 from fastapi import Depends
 
-from back.exceptions import NoteNotFoundException
+from back.exceptions import PermissionDeniedException
 
-from .database import get_note_repo
-from .get_project import (get_invited_user_repo, get_project_editor,
-                          get_project_viewer)
-from .get_user import get_user_db
+from .get_context import AccessContext, get_note_context
 
 
-async def get_note(note_id: UUID,
-                   nr: NoteRepository = Depends(get_note_repo)
-                   ) -> Note:
-    note = await nr.get_by_id(note_id)
-    if note is None:
-        raise NoteNotFoundException(note_id)
-    return note
+async def get_note(context: AccessContext = Depends(get_note_context)) -> Note:
+    return context.note  # type: ignore
 
 
-async def get_note_viewer(note: Note = Depends(get_note),
-                          user: User = Depends(get_user_db),
-                          iur: InvitedUserRepository = Depends(
-                              get_invited_user_repo)
-                          ) -> User:
-    return await get_project_viewer(note.file.project, user)
+async def get_note_viewer(context: AccessContext = Depends(get_note_context)) -> User:
+    if not context.can_view:
+        raise PermissionDeniedException()
+    return context.user
 
 
-async def get_note_editor(note: Note = Depends(get_note),
-                          user: User = Depends(get_user_db)
-                          ) -> User:
-    return await get_project_editor(note.file.project, user)
+async def get_note_editor(context: AccessContext = Depends(get_note_context)) -> User:
+    if not context.can_edit:
+        raise PermissionDeniedException()
+    return context.user
@@ -0,0 +1,41 @@
+
+
+from uuid import UUID
+
+from fastapi import Depends
+from redis.asyncio import Redis
+
+from back.exceptions import (PermissionDeniedException,
+                             UploadSessionNotFoundException,
+                             UploadTicketNotFoundException)
+from back.schemas import (RedisUploadSessionSchema, RedisUploadTicketSchema,
+                          UserSchema)
+from database.redis import RedisType, get_redis_client
+
+from .get_user import get_user
+
+
+async def get_upload_session(upload_id: UUID,
+                             user: UserSchema = Depends(get_user),
+                             redis: Redis = Depends(get_redis_client)
+                             ) -> RedisUploadSessionSchema:
+    data = await redis.get(f"{RedisType.upload_session}:{upload_id}")
+    if data is None:
+        raise UploadSessionNotFoundException(upload_id)
+    upload_session = RedisUploadSessionSchema.model_validate_json(data)
+    if upload_session.user_id != user.id:
+        raise PermissionDeniedException()
+    return upload_session
+
+
+async def get_upload_ticket(ticket_id: UUID,
+                            user: UserSchema = Depends(get_user),
+                            redis: Redis = Depends(get_redis_client)
+                            ) -> RedisUploadTicketSchema:
+    data = await redis.get(f"{RedisType.upload_ticket}:{ticket_id}")
+    if data is None:
+        raise UploadTicketNotFoundException(ticket_id)
+    upload_ticket = RedisUploadTicketSchema.model_validate_json(data)
+    if upload_ticket.user_id != user.id:
+        raise PermissionDeniedException()
+    return upload_ticket
@@ -5,11 +5,15 @@ from deva_p1_db.repositories import (InvitedUserRepository, ProjectRepository,
                                      UserRepository)
 from fastapi import Cookie, Depends
 from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from back.exceptions import *
 from back.schemas import InvitedUserSchema, UserSchema
 from back.token import AccessToken
-from database.redis import RedisType, get_redis_client
+from back.token_cache import get_invalidated_at, token_cache
+from back.user_cache import attach_cached_user, get_cached_user
+from database.database import session_manager
+from database.redis import get_redis_client
 
 from .database import get_invited_user_repo, get_project_repo, get_user_repo
 
@@ -19,24 +23,30 @@ async def get_user(access_token: str = Cookie(default=None),
                    ) -> UserSchema:
     if access_token is None:
         raise AccessTokenDoesNotExistException()
+    user = token_cache.get(access_token)
+    if user is not None:
+        return user
     access = AccessToken.from_token(access_token)
     current_time = datetime.now(UTC).replace(tzinfo=None)
     if access.created_date > current_time or access.created_date + access.lifetime < current_time:
         raise AccessTokenExpiredException()
-    if await redis.exists(f"{RedisType.invalidated_access_token}:{access.user.id}"):
-        raise AccessTokenInvalidatedException()
     if access.user is None:
         raise AccessTokenDamagedException()
+    if access.created_date.replace(tzinfo=UTC).timestamp() <= await get_invalidated_at(redis, access.user.id):
+        raise AccessTokenInvalidatedException()
+    token_cache.put(access_token, access)
     return access.user
 
 
 async def get_user_db(user: UserSchema = Depends(get_user),
-                      ur: UserRepository = Depends(get_user_repo)
+                      redis: Redis = Depends(get_redis_client),
+                      ur: UserRepository = Depends(get_user_repo),
+                      session: AsyncSession = Depends(session_manager.session)
                       ) -> User:
-    user_db = await ur.get_by_id(user.id)
-    if user_db is None:
+    cached_user = await get_cached_user(redis, ur, user.id)
+    if cached_user is None:
         raise SendFeedbackToAdminException()
-    return user_db
+    return await attach_cached_user(session, cached_user)
 
 
 async def util(invited_user_schema: InvitedUserSchema,
@@ -3,5 +3,8 @@ from .s400 import *
 from .s401 import *
 from .s403 import *
 from .s404 import *
+from .s413 import *
+from .s415 import *
 from .s416 import *
 from .s500 import *
+from .s503 import *
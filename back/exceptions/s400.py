@@ -90,4 +90,19 @@ class UserNotInvitedException(BaseCustomHTTPException):
 
 class SummaryInTimeWithOtherTasksException(BaseCustomHTTPException):
     def __init__(self):
-        super().__init__(400, "Summary in time with other tasks")
\ No newline at end of file
+        super().__init__(400, "Summary in time with other tasks")
+
+
+class InvalidUploadPartException(BaseCustomHTTPException):
+    def __init__(self, part_number: int):
+        super().__init__(400, f"Upload part {part_number} is out of range or has a wrong size")
+
+
+class UploadIsNotCompleteException(BaseCustomHTTPException):
+    def __init__(self, missing_parts: list[int]):
+        super().__init__(400, f"Upload is not complete, missing parts: {missing_parts}")
+
+
+class MalformedMultipartBodyException(BaseCustomHTTPException):
+    def __init__(self):
+        super().__init__(400, "Request body is not valid multipart/form-data")
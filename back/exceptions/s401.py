@@ -50,12 +50,14 @@ class InvalidCredentialsException(BaseCustomHTTPException):
 class LoginLockedException(BaseCustomHTTPException):
     def __init__(self, seconds: int):
         super().__init__(
-            401, f"Too many attempts. Try again in {seconds} seconds")
+            401, f"Too many attempts. Try again in {seconds} seconds",
+            headers={"Retry-After": str(seconds)})
 
 
 class TooManyIncorrectCredentialsException(BaseCustomHTTPException):
-    def __init__(self, ip: str):
-        super().__init__(401, f"Too many failed login attempts from IP: {ip}")
+    def __init__(self, ip: str, seconds: int | None = None):
+        super().__init__(401, f"Too many failed login attempts from IP: {ip}",
+                         headers={"Retry-After": str(seconds)} if seconds is not None else None)
 
 
 
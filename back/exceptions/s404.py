@@ -29,4 +29,16 @@ class TaskNotFoundException(BaseCustomHTTPException):
         super().__init__(404, f"Task not found, task_id: {task_id}")
 
 
+class UploadSessionNotFoundException(BaseCustomHTTPException):
+    def __init__(self, upload_id: UUID):
+        super().__init__(404, f"Upload session not found, upload_id: {upload_id}")
 
+
+class UploadTicketNotFoundException(BaseCustomHTTPException):
+    def __init__(self, ticket_id: UUID):
+        super().__init__(404, f"Upload ticket not found, ticket_id: {ticket_id}")
+
+
+class UploadedObjectNotFoundException(BaseCustomHTTPException):
+    def __init__(self, ticket_id: UUID):
+        super().__init__(404, f"Nothing was uploaded for ticket {ticket_id}")
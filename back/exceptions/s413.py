@@ -0,0 +1,7 @@
+
+from .base import BaseCustomHTTPException
+
+
+class FileTooLargeException(BaseCustomHTTPException):
+    def __init__(self, max_size: int):
+        super().__init__(413, f"File is too large, max size: {max_size} bytes")
@@ -0,0 +1,7 @@
+
+from .base import BaseCustomHTTPException
+
+
+class UnsupportedUploadContentTypeException(BaseCustomHTTPException):
+    def __init__(self):
+        super().__init__(415, "Upload must be sent as multipart/form-data")
@@ -8,5 +8,6 @@ class RangeHeaderRequiredException(BaseCustomHTTPException):
 
 
 class InvalidRangeHeaderException(BaseCustomHTTPException):
-    def __init__(self):
-        super().__init__(416, "Range header is invalid or unsatisfiable")
+    def __init__(self, file_size: int | None = None):
+        super().__init__(416, "Range header is invalid or unsatisfiable",
+                         None if file_size is None else {"Content-Range": f"bytes */{file_size}"})
@@ -0,0 +1,7 @@
+from .base import BaseCustomHTTPException
+
+
+class PasswordHashingBusyException(BaseCustomHTTPException):
+    def __init__(self, seconds: int):
+        super().__init__(503, "Too many authentication requests, try again later",
+                         headers={"Retry-After": str(seconds)})
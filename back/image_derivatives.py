@@ -0,0 +1,105 @@
+
+
+import asyncio
+from io import BytesIO
+
+from minio import S3Error
+from PIL import Image, ImageOps, UnidentifiedImageError
+from redis.asyncio import Redis
+
+from back.config import Config
+from database.minio import AsyncMinio, open_s3_client
+from database.redis import RedisType, get_redis_client
+
+DERIVATIVE_READY = "ready"
+DERIVATIVE_FAILED = "failed"
+
+derivative_tasks: dict[str, asyncio.Task[None]] = {}
+derivative_slots = asyncio.Semaphore(Config.image_derivative_workers)
+
+
+def derivative_object_name(object_name: str, width: int | None) -> str:
+    if width is None:
+        return f"{object_name}.webp"
+    return f"{object_name}.w{width}.webp"
+
+
+def derivative_width(size: int) -> int | None:
+    """Smallest thumbnail at least as wide as requested, the full size WebP otherwise."""
+    for width in sorted(Config.image_derivative_widths):
+        if width >= size:
+            return width
+    return None
+
+
+def render_image_derivatives(data: bytes) -> dict[int | None, bytes]:
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+        variants: dict[int | None, bytes] = {}
+        for width in (None, *Config.image_derivative_widths):
+            variant = image
+            if width is not None and width < image.width:
+                variant = image.resize((width, max(round(image.height * width / image.width), 1)),
+                                       Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            variant.save(buffer, "WEBP", quality=Config.image_derivative_quality)
+            variants[width] = buffer.getvalue()
+        return variants
+
+
+async def build_image_derivatives(object_name: str) -> None:
+    minio_client = open_s3_client()
+    redis = get_redis_client()
+    try:
+        async with derivative_slots:
+            data = await minio_client.read_object(object_name)
+            try:
+                variants = await asyncio.to_thread(render_image_derivatives, data)
+            except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+                await redis.hset(RedisType.image_derivatives, object_name, DERIVATIVE_FAILED)  # type: ignore
+                return
+            for width, variant in variants.items():
+                await minio_client.put_object(derivative_object_name(object_name, width),
+                                              BytesIO(variant), len(variant),
+                                              content_type="image/webp")
+        await redis.hset(RedisType.image_derivatives, object_name, DERIVATIVE_READY)  # type: ignore
+    except S3Error:
+        pass  # retried the next time the derivative is requested
+    finally:
+        derivative_tasks.pop(object_name, None)
+        await redis.aclose()
+
+
+def schedule_image_derivatives(object_names: list[str]) -> None:
+    for object_name in object_names:
+        if object_name not in derivative_tasks:
+            derivative_tasks[object_name] = asyncio.create_task(build_image_derivatives(object_name))
+
+
+async def get_derivative_names(redis: Redis, object_names: list[str], size: int) -> dict[str, str]:
+    """Maps image objects to the derivative matching size. Objects without
+    derivatives yet map to themselves and get them built in the background."""
+    if not object_names:
+        return {}
+    width = derivative_width(size)
+    states = await redis.hmget(RedisType.image_derivatives, object_names)  # type: ignore
+    schedule_image_derivatives([name for name, state in zip(object_names, states) if state is None])
+    return {name: derivative_object_name(name, width) if state == DERIVATIVE_READY else name
+            for name, state in zip(object_names, states)}
+
+
+async def remove_image_derivatives(redis: Redis, minio_client: AsyncMinio, object_name: str) -> None:
+    if await redis.hget(RedisType.image_derivatives, object_name) == DERIVATIVE_READY:  # type: ignore
+        for width in (None, *Config.image_derivative_widths):
+            await minio_client.remove_object(derivative_object_name(object_name, width))
+    await redis.hdel(RedisType.image_derivatives, object_name)  # type: ignore
+
+
+async def close_image_derivatives() -> None:
+    tasks = list(derivative_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
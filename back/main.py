@@ -1,14 +1,55 @@
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
 from back.api import router
+from back.api.upload import close_upload_cleanup, open_upload_cleanup
 from back.broker import router as faststream_router
+from back.consumers import progress_consumers, task_consumers
+from back.content_index import close_deduplication
+from back.image_derivatives import close_image_derivatives
+from back.metrics import register_metrics
+from back.outbox import outbox_relay
+from back.password import close_password_hasher, open_password_hasher
+from back.progress import progress_coalescer
+from back.token_cache import close_token_cache, open_token_cache
+from back.user_cache import user_cache
+from database.media_cache import close_media_cache, open_media_cache
+from database.minio import close_s3_client, open_s3_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    s3_client = open_s3_client()
+    media_cache = open_media_cache()
+    token_cache = open_token_cache()
+    password_hasher = open_password_hasher()
+    open_upload_cleanup()
+    register_metrics("minio", s3_client.pool_metrics)
+    register_metrics("media_cache", media_cache.metrics)
+    register_metrics("access_token_cache", token_cache.metrics)
+    register_metrics("user_cache", user_cache.metrics)
+    register_metrics("password_hasher", password_hasher.metrics)
+    register_metrics("outbox", outbox_relay.metrics)
+    register_metrics("progress", progress_coalescer.metrics)
+    register_metrics("task_consumers", task_consumers.metrics)
+    register_metrics("progress_consumers", progress_consumers.metrics)
+    yield
+    await close_upload_cleanup()
+    close_password_hasher()
+    await close_token_cache()
+    await close_deduplication()
+    await close_image_derivatives()
+    close_media_cache()
+    close_s3_client()
+
 
 app = FastAPI(docs_url="/api/docs", redoc_url="/api/redoc",
               openapi_url="/api/openapi.json", swagger_ui_parameters={
                   "tryItOutEnabled": True,
-              })
+              }, lifespan=lifespan)
 
 
 app.include_router(router)
 app.include_router(faststream_router)
+
@@ -0,0 +1,12 @@
+
+from typing import Any, Callable
+
+metrics_sources: dict[str, Callable[[], dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, collect: Callable[[], dict[str, Any]]) -> None:
+    metrics_sources[name] = collect
+
+
+def collect_metrics() -> dict[str, dict[str, Any]]:
+    return {name: collect() for name, collect in metrics_sources.items()}
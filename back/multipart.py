@@ -0,0 +1,97 @@
+
+
+from collections import deque
+from typing import AsyncIterator
+
+from python_multipart.multipart import (MultipartParseError, MultipartParser,
+                                        parse_options_header)
+
+from back.exceptions import (MalformedMultipartBodyException,
+                             UndefinedFileTypeException)
+
+
+class MultipartFileReader:
+    """Parses a multipart/form-data body while it is received and hands out
+    the bytes of one file field as they arrive, unlike request.form() which
+    spools the whole body to disk first. Other fields are skipped."""
+
+    def __init__(self, body: AsyncIterator[bytes], content_type: str, field_name: str = "file") -> None:
+        _, options = parse_options_header(content_type)
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise MalformedMultipartBodyException()
+        self.body = body
+        self.field_name = field_name
+        self.filename: str | None = None
+        self.pending: deque[bytes] = deque()
+        self.done = False
+        self.in_file = False
+        self.headers: dict[bytes, bytes] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        })
+
+    def on_part_begin(self) -> None:
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        if self.filename is None and options.get(b"name") == self.field_name.encode() \
+                and b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self.in_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.in_file:
+            self.pending.append(bytes(data[start:end]))
+
+    def on_part_end(self) -> None:
+        if self.in_file:
+            self.in_file = False
+            self.done = True
+
+    async def feed(self) -> bool:
+        chunk = await anext(self.body, None)
+        try:
+            if chunk is None:
+                self.parser.finalize()
+                return False
+            self.parser.write(chunk)
+        except MultipartParseError:
+            raise MalformedMultipartBodyException()
+        return True
+
+    async def open(self) -> str:
+        """Reads up to the headers of the file field and returns its file name."""
+        while self.filename is None:
+            if not await self.feed():
+                raise UndefinedFileTypeException()
+        return self.filename
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while True:
+            while self.pending:
+                yield self.pending.popleft()
+            if self.done:
+                return
+            if not await self.feed():
+                raise MalformedMultipartBodyException()
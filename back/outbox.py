@@ -0,0 +1,112 @@
+
+
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any
+
+from faststream.rabbit import RabbitBroker
+from pydantic import BaseModel
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from back.config import Config
+from database.database import session_manager
+from database.outbox import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_message(session: AsyncSession, queue: str, data: BaseModel) -> None:
+    """Adds the message to the caller's transaction. It is published once
+    that commits, call outbox_relay.wake() afterwards to skip the poll delay."""
+    session.add(OutboxMessage(queue=queue, payload=data.model_dump(mode="json")))
+
+
+class OutboxRelay:
+    """Publishes committed outbox rows in batches. Every batch is published
+    concurrently on the confirming channel, so a batch waits for one round
+    of broker acks instead of one per message. Rows are locked with SKIP
+    LOCKED and only marked sent once confirmed, so several workers can relay
+    side by side and a crash at worst publishes a batch twice."""
+
+    def __init__(self, batch_size: int, interval: float) -> None:
+        self.batch_size = batch_size
+        self.interval = interval
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task[None] | None = None
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "running": self.task is not None and not self.task.done(),
+            "batch_size": self.batch_size,
+            "sent": self.sent,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    def wake(self) -> None:
+        self.wakeup.set()
+
+    def start(self, broker: RabbitBroker) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run(broker))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self, broker: RabbitBroker) -> None:
+        while True:
+            try:
+                published = await self.relay_batch(broker)
+                if published == 0:
+                    await self.purge_sent()
+            except Exception:
+                logger.exception("outbox relay failed, retrying in %s seconds", self.interval)
+                published = 0
+            if published < self.batch_size:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+    async def relay_batch(self, broker: RabbitBroker) -> int:
+        async with session_manager.context_session() as session:
+            messages = list(await session.scalars(
+                select(OutboxMessage)
+                .where(OutboxMessage.sent_date.is_(None))
+                .order_by(OutboxMessage.created_date)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)))
+            if not messages:
+                return 0
+            results = await asyncio.gather(*(broker.publish(message.payload, message.queue)
+                                             for message in messages),
+                                           return_exceptions=True)
+            sent_ids = [message.id for message, result in zip(messages, results)
+                        if not isinstance(result, BaseException) and result is not False]
+            if sent_ids:
+                await session.execute(update(OutboxMessage)
+                                      .where(OutboxMessage.id.in_(sent_ids))
+                                      .values(sent_date=func.now()))
+            await session.commit()
+        self.batches += 1
+        self.sent += len(sent_ids)
+        self.failed += len(messages) - len(sent_ids)
+        return len(sent_ids)
+
+    async def purge_sent(self) -> None:
+        async with session_manager.context_session() as session:
+            await session.execute(delete(OutboxMessage).where(
+                OutboxMessage.sent_date < func.now() - timedelta(seconds=Config.outbox_retention)))
+            await session.commit()
+
+
+outbox_relay = OutboxRelay(Config.outbox_batch_size, Config.outbox_interval)
@@ -0,0 +1,93 @@
+
+
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from back.config import Config
+from back.exceptions import PasswordHashingBusyException
+
+# verified against when the login does not exist, so both paths cost one hash
+DUMMY_PASSWORD_HASH = generate_password_hash("dummy password")
+
+
+class PasswordHasher:
+    """Runs password hashing on a dedicated process pool so login storms
+    don't stall the event loop. Requests beyond max_pending are rejected
+    instead of queueing behind the pool."""
+
+    def __init__(self, workers: int, max_pending: int) -> None:
+        # forked workers would inherit the event loop, sockets and locks
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context("forkserver"))
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.timings: dict[str, dict[str, float]] = {}
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "operations": {
+                name: {**timing, "avg_seconds": timing["total_seconds"] / timing["count"]}
+                for name, timing in self.timings.items()
+            },
+        }
+
+    def record(self, operation: str, seconds: float) -> None:
+        timing = self.timings.setdefault(operation, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        timing["count"] += 1
+        timing["total_seconds"] += seconds
+        timing["max_seconds"] = max(timing["max_seconds"], seconds)
+
+    async def run(self, operation: str, func: Callable[..., Any], *args: Any) -> Any:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHashingBusyException(Config.password_retry_after)
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+            self.record(operation, time.perf_counter() - started)
+
+    async def hash(self, password: str) -> str:
+        return await self.run("hash", generate_password_hash, password)
+
+    async def verify(self, hashed_password: str | None, password: str) -> bool:
+        return await self.run("verify", check_password_hash, hashed_password or DUMMY_PASSWORD_HASH, password) \
+            and hashed_password is not None
+
+
+password_hasher: PasswordHasher | None = None
+
+
+def open_password_hasher() -> PasswordHasher:
+    global password_hasher
+    if password_hasher is None:
+        password_hasher = PasswordHasher(Config.password_workers, Config.password_max_pending)
+    return password_hasher
+
+
+def close_password_hasher() -> None:
+    global password_hasher
+    if password_hasher is not None:
+        password_hasher.close()
+        password_hasher = None
+
+
+async def get_password_hasher() -> PasswordHasher:
+    return open_password_hasher()
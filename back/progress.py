@@ -0,0 +1,131 @@
+
+
+import asyncio
+from collections import OrderedDict
+from typing import Any
+from uuid import UUID
+
+from redis.asyncio import Redis
+
+from back.config import Config
+from back.task_graph import record_graph_progress
+from database.redis import RedisType, get_redis_client
+
+TERMINAL_PROGRESS = 1.0
+
+
+class ProgressCoalescer:
+    """Keeps only the latest progress per task and writes it to redis every
+    interval seconds in one pipeline. Websocket clients poll once a second,
+    so intermediate values would never be seen anyway.
+
+    Updates must arrive in the order the AI sent them, which the progress
+    consumer keeps per task. Completion and progress going backwards (a
+    task restarted by the AI) are then written right away, so clients never
+    see a stale value for them. Writes are serialized, and updates of tasks
+    already reported done or failed are dropped, so no flush can land after
+    the final status."""
+
+    def __init__(self, interval: float, tracked_size: int) -> None:
+        self.interval = interval
+        self.tracked_size = tracked_size
+        self.pending: dict[UUID, float] = {}
+        self.written: OrderedDict[UUID, float] = OrderedDict()
+        self.finished: OrderedDict[UUID, None] = OrderedDict()
+        self.lock = asyncio.Lock()
+        self.task: asyncio.Task[None] | None = None
+        self.received = 0
+        self.writes = 0
+        self.flushes = 0
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "pending": len(self.pending),
+            "received": self.received,
+            "writes": self.writes,
+            "flushes": self.flushes,
+        }
+
+    async def update(self, redis: Redis, task_id: UUID, progress: float) -> None:
+        self.received += 1
+        if task_id in self.finished:
+            return
+        last = self.written.get(task_id)
+        if progress >= TERMINAL_PROGRESS or (last is not None and progress < last):
+            async with self.lock:
+                self.pending.pop(task_id, None)
+                await self.write(redis, {task_id: progress})
+        else:
+            self.pending[task_id] = progress
+            self.start()
+
+    async def discard(self, task_id: UUID) -> None:
+        """Drops the buffered updates of a finished task and ignores later
+        ones. Waits for a write in flight, so the caller's final status is
+        written last."""
+        self.finished[task_id] = None
+        self.finished.move_to_end(task_id)
+        while len(self.finished) > self.tracked_size:
+            self.finished.popitem(last=False)
+        async with self.lock:
+            self.pending.pop(task_id, None)
+            self.written.pop(task_id, None)
+
+    async def write(self, redis: Redis, progress: dict[UUID, float]) -> None:
+        async with redis.pipeline(transaction=False) as pipe:
+            for task_id, value in progress.items():
+                pipe.set(f"{RedisType.task_status}:{task_id}", value, ex=Config.redis_task_status_lifetime)
+            await pipe.execute()
+        await record_graph_progress(redis, progress)
+        for task_id, value in progress.items():
+            # terminal values stay too, so a restart after them counts as going backwards
+            self.written[task_id] = value
+            self.written.move_to_end(task_id)
+        while len(self.written) > self.tracked_size:
+            self.written.popitem(last=False)
+        self.writes += len(progress)
+
+    async def flush(self, redis: Redis) -> None:
+        async with self.lock:
+            if not self.pending:
+                return
+            progress, self.pending = self.pending, {}
+            self.flushes += 1
+            try:
+                await self.write(redis, progress)
+            except Exception:
+                # keep the values unless newer ones arrived or the task finished while writing
+                self.pending = {task_id: value for task_id, value in progress.items()
+                                if task_id not in self.finished} | self.pending
+                raise
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        redis = get_redis_client()
+        try:
+            while self.pending:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.flush(redis)
+                except Exception:
+                    pass  # retried on the next interval
+        finally:
+            await redis.aclose()
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        redis = get_redis_client()
+        try:
+            await self.flush(redis)
+        finally:
+            await redis.aclose()
+
+
+progress_coalescer = ProgressCoalescer(Config.progress_flush_interval, Config.progress_tracked_size)
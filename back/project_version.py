@@ -0,0 +1,26 @@
+
+import time
+from uuid import UUID
+
+from redis.asyncio import Redis
+
+from back.config import Config
+from database.redis import RedisType
+
+
+async def bump_project_version(redis: Redis, project_id: UUID) -> None:
+    # seeding with a timestamp keeps versions unique even if redis loses the key
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.set(f"{RedisType.project_version}:{project_id}", time.time_ns(), nx=True)
+        pipe.incr(f"{RedisType.project_version}:{project_id}")
+        await pipe.execute()
+
+
+async def get_project_version(redis: Redis, project_id: UUID) -> int:
+    await redis.set(f"{RedisType.project_version}:{project_id}", time.time_ns(), nx=True)
+    return int(await redis.get(f"{RedisType.project_version}:{project_id}"))  # type: ignore
+
+
+async def mark_project_updated(redis: Redis, project_id: UUID) -> None:
+    await redis.set(f"{RedisType.project_update}:{project_id}", 1, ex=Config.websocket_redis_message_lifetime)
+    await bump_project_version(redis, project_id)
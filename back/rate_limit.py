@@ -0,0 +1,68 @@
+
+
+import math
+import time
+from uuid import uuid4
+
+from redis.asyncio import Redis
+
+from database.redis import register_script
+
+# KEYS: one sorted set of attempt timestamps per limit
+# ARGV: now_ms, attempt id, then limit and window_ms for every key
+# Returns {index of the first exhausted limit or -1, lockout ms}. The attempt
+# is only recorded when every limit still has room.
+SLIDING_WINDOW_SCRIPT = register_script("""
+local now = tonumber(ARGV[1])
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2 + 1])
+    local window = tonumber(ARGV[i * 2 + 2])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        return {i - 1, tonumber(oldest[2]) + window - now}
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[2])
+    redis.call('PEXPIRE', key, ARGV[i * 2 + 2])
+end
+return {-1, 0}
+""")
+
+
+class RateLimit:
+    def __init__(self, key: str, limit: int, window: int) -> None:
+        self.key = key
+        self.limit = limit
+        self.window = window
+
+
+class RateLimitAttempt:
+    def __init__(self, limits: list[RateLimit], attempt_id: str, exceeded: RateLimit | None, lockout: int) -> None:
+        self.limits = limits
+        self.attempt_id = attempt_id
+        self.exceeded = exceeded
+        self.lockout = lockout
+
+    async def forgive(self, redis: Redis) -> None:
+        """Drops the attempt from every window, e.g. after a successful login."""
+        async with redis.pipeline(transaction=False) as pipe:
+            for limit in self.limits:
+                pipe.zrem(limit.key, self.attempt_id)
+            await pipe.execute()
+
+
+async def hit_rate_limits(redis: Redis, limits: list[RateLimit]) -> RateLimitAttempt:
+    """Checks all sliding windows and records the attempt in one atomic round trip."""
+    attempt_id = uuid4().hex
+    args: list[int | str] = [int(time.time() * 1000), attempt_id]
+    for limit in limits:
+        args += [limit.limit, limit.window * 1000]
+    index, lockout = await SLIDING_WINDOW_SCRIPT(keys=[limit.key for limit in limits],
+                                                 args=args,
+                                                 client=redis)  # type: ignore
+    return RateLimitAttempt(limits,
+                            attempt_id,
+                            limits[index] if index >= 0 else None,
+                            math.ceil(lockout / 1000))
@@ -1,9 +1,13 @@
 
-from .file import FileDownloadURLSchema, FileEditSchema, FileSchema
+from .file import (FileDownloadURLSchema, FileEditSchema, FileMetaSchema,
+                   FileSchema)
 from .invited_user import InvitedUserSchema
 from .note import CreateNoteSchema, NoteSchema, UpdateNoteSchema
 from .project import CreateProjectSchema, EditProjectSchema, ProjectSchema
 from .task import (ActiveTaskSchema, RedisTaskCacheSchema, TaskCreateSchema,
                    TaskSchema)
+from .upload import (CreateUploadSchema, CreateUploadTicketSchema,
+                     RedisUploadSessionSchema, RedisUploadTicketSchema,
+                     UploadSessionSchema, UploadTicketSchema)
 from .user import CredsSchema, RegisterSchema, UserSchema, UserUpdateSchema
 from .websocket import WebsocketMessage
@@ -41,3 +41,12 @@ class FileEditSchema(BaseModel):
     metadata_is_hide: bool | None = None
     metadata_text: str | None = None
     metadata_timecode: float | None = None
+
+
+class FileMetaSchema(BaseModel):
+    object_name: str
+    size: int
+    etag: str
+    content_type: str
+    last_modified: datetime
+    version: str
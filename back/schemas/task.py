@@ -21,6 +21,7 @@ class RedisTaskCacheSchema(BaseModel):
     id: UUID
     project_id: UUID
     task_type: str
+    expires_at: float = 0.0
 
     @classmethod
     def from_db(cls, task: Task) -> "RedisTaskCacheSchema":
@@ -0,0 +1,76 @@
+
+
+from uuid import UUID
+
+from pydantic import BaseModel, Field
+
+from back.config import Config
+
+
+class CreateUploadSchema(BaseModel):
+    file_name: str
+    file_size: int = Field(gt=0, le=Config.upload_max_size)
+
+
+class RedisUploadSessionSchema(BaseModel):
+    id: UUID
+    upload_id: str
+    object_name: str
+    project_id: UUID
+    user_id: UUID
+    file_name: str
+    content_type: str
+    file_size: int
+    part_size: int
+
+    @property
+    def part_count(self) -> int:
+        return max(1, -(-self.file_size // self.part_size))
+
+    def part_length(self, part_number: int) -> int:
+        if part_number < self.part_count:
+            return self.part_size
+        return self.file_size - self.part_size * (self.part_count - 1)
+
+
+class UploadSessionSchema(BaseModel):
+    id: UUID
+    file_name: str
+    file_size: int
+    part_size: int
+    part_count: int
+    received_parts: list[int]
+    received_offsets: list[tuple[int, int]]
+
+    @classmethod
+    def from_redis(cls, session: RedisUploadSessionSchema, received_parts: list[int]) -> "UploadSessionSchema":
+        received_parts = sorted(received_parts)
+        return cls(id=session.id,
+                   file_name=session.file_name,
+                   file_size=session.file_size,
+                   part_size=session.part_size,
+                   part_count=session.part_count,
+                   received_parts=received_parts,
+                   received_offsets=[((n - 1) * session.part_size,
+                                      (n - 1) * session.part_size + session.part_length(n))
+                                     for n in received_parts])
+
+
+class CreateUploadTicketSchema(BaseModel):
+    file_name: str
+
+
+class RedisUploadTicketSchema(BaseModel):
+    id: UUID
+    object_name: str
+    project_id: UUID
+    user_id: UUID
+    file_name: str
+    content_type: str
+
+
+class UploadTicketSchema(BaseModel):
+    id: UUID
+    upload_url: str
+    content_type: str
+    expires_in: int
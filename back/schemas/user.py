@@ -1,9 +1,11 @@
 
 
+from typing import Any
 from uuid import UUID
 
 from deva_p1_db.models.user import User
 from pydantic import BaseModel
+from sqlalchemy import inspect
 
 
 class UserSchema (BaseModel):
@@ -14,6 +16,21 @@ class UserSchema (BaseModel):
     def from_db(cls, user: User) -> "UserSchema":
         return UserSchema(**user.__dict__)
 
+class CachedUserSchema (BaseModel):
+    id: UUID
+    login: str
+    secret: str
+    columns: dict[str, Any]
+
+    @classmethod
+    def from_db(cls, user: User) -> "CachedUserSchema":
+        return CachedUserSchema(id=user.id, login=user.login, secret=user.secret,
+                                columns={attr.key: getattr(user, attr.key)
+                                         for attr in inspect(User).column_attrs})
+
+    def to_schema(self) -> UserSchema:
+        return UserSchema(id=self.id, login=self.login)
+
 class CredsSchema (BaseModel):
     login: str
     password: str
@@ -0,0 +1,108 @@
+
+
+from typing import Callable
+from uuid import UUID
+
+from deva_p1_db.enums.file_type import FileCategory, resolve_file_type
+from deva_p1_db.enums.task_type import TaskType
+from deva_p1_db.models import Project, Task
+from redis.asyncio import Redis
+
+from back.config import Config
+from database.redis import RedisType
+
+
+class TaskNode:
+    """An AI step. A dependency only becomes part of a run when `needed`
+    says the project lacks its result; the requested step always runs."""
+
+    def __init__(self,
+                 task_type: str,
+                 depends_on: tuple[str, ...] = (),
+                 needed: Callable[[Project], bool] = lambda project: True
+                 ) -> None:
+        self.task_type = task_type
+        self.depends_on = depends_on
+        self.needed = needed
+
+
+def is_video(project: Project) -> bool:
+    return project.origin_file is not None \
+        and resolve_file_type(project.origin_file.file_type).category == FileCategory.video.value
+
+
+TASK_GRAPH: dict[str, TaskNode] = {node.task_type: node for node in (
+    TaskNode(TaskType.transcribe.value,
+             needed=lambda project: project.transcription_id is None),
+    TaskNode(TaskType.frames_extract.value,
+             needed=lambda project: not project.frames_extract_done and is_video(project)),
+    TaskNode(TaskType.summary.value,
+             depends_on=(TaskType.transcribe.value, TaskType.frames_extract.value)),
+)}
+
+
+def plan_tasks(project: Project, task_type: str) -> list[str]:
+    """Task types to run for task_type, every dependency before its dependents."""
+    plan: list[str] = []
+
+    def visit(node_type: str) -> None:
+        if node_type in plan:
+            return
+        node = TASK_GRAPH.get(node_type)
+        for dependency in node.depends_on if node else ():
+            if TASK_GRAPH[dependency].needed(project):
+                visit(dependency)
+        plan.append(node_type)
+
+    visit(task_type)
+    return plan
+
+
+def ready_tasks(subtasks: list[Task], done_ids: set[UUID]) -> list[Task]:
+    """Pending subtasks none of whose dependencies are still pending in the same run."""
+    pending = [task for task in subtasks if task.id not in done_ids]
+    pending_types = {task.task_type for task in pending}
+    return [task for task in pending
+            if task.task_type not in TASK_GRAPH
+            or not pending_types.intersection(TASK_GRAPH[task.task_type].depends_on)]
+
+
+async def claim_dispatch(redis: Redis, origin_id: UUID, task_id: UUID) -> bool:
+    """True for exactly one caller per subtask, done handlers may race."""
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.sadd(f"{RedisType.task_graph_dispatched}:{origin_id}", str(task_id))
+        pipe.expire(f"{RedisType.task_graph_dispatched}:{origin_id}", Config.task_graph_lifetime)
+        added, _ = await pipe.execute()
+    return added == 1
+
+
+async def start_task_graph(redis: Redis, origin_id: UUID, subtasks: list[Task]) -> None:
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(f"{RedisType.task_graph_progress}:{origin_id}",
+                  mapping={str(task.id): 0.0 for task in subtasks})
+        pipe.expire(f"{RedisType.task_graph_progress}:{origin_id}", Config.task_graph_lifetime)
+        for task in subtasks:
+            pipe.set(f"{RedisType.task_graph_origin}:{task.id}", str(origin_id), ex=Config.task_graph_lifetime)
+        await pipe.execute()
+
+
+async def record_graph_progress(redis: Redis, progress: dict[UUID, float]) -> None:
+    """Publishes the mean progress of all subtasks as each origin task's status."""
+    origin_ids = await redis.mget([f"{RedisType.task_graph_origin}:{task_id}" for task_id in progress])
+    graphs: dict[str, dict[str, float]] = {}
+    for (task_id, value), origin_id in zip(progress.items(), origin_ids):
+        if origin_id is not None:
+            graphs.setdefault(origin_id, {})[str(task_id)] = value
+    if not graphs:
+        return
+    async with redis.pipeline(transaction=True) as pipe:
+        for origin_id, values in graphs.items():
+            pipe.hset(f"{RedisType.task_graph_progress}:{origin_id}", mapping=values)
+            pipe.hvals(f"{RedisType.task_graph_progress}:{origin_id}")
+        results = await pipe.execute()
+    async with redis.pipeline(transaction=False) as pipe:
+        for origin_id, values in zip(graphs, results[1::2]):
+            pipe.set(f"{RedisType.task_status}:{origin_id}",
+                     sum(float(value) for value in values) / len(values),
+                     ex=Config.redis_task_status_lifetime)
+        await pipe.execute()
@@ -0,0 +1,139 @@
+
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import UTC, datetime
+from typing import Any, Callable
+from uuid import UUID
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from back.config import Config
+from back.schemas.user import UserSchema
+from back.token import AccessToken
+from database.redis import RedisType, get_redis_client
+
+
+class AccessTokenCache:
+    """Bounded LRU of verified access tokens, keyed by token digest.
+
+    Entries never outlive their token. Invalidations arrive over redis
+    pub/sub, and while the subscription is down the cache is bypassed so
+    get_user falls back to checking redis on every request."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.tokens: OrderedDict[bytes, tuple[UserSchema, float, float]] = OrderedDict()
+        self.invalidated: dict[UUID, float] = {}
+        self.connected = False
+        self.on_invalidate: list[Callable[[UUID], None]] = []
+        self.on_clear: list[Callable[[], None]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def metrics(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.tokens),
+            "max_size": self.max_size,
+            "connected": self.connected,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        self.tokens.clear()
+        self.invalidated.clear()
+        for callback in self.on_clear:
+            callback()
+
+    def get(self, token: str) -> UserSchema | None:
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self.tokens.get(key)
+        if entry is None or not self.connected:
+            self.misses += 1
+            return None
+        user, created, expires = entry
+        if expires < time.time() or created <= self.invalidated.get(user.id, 0.0):
+            del self.tokens[key]
+            self.misses += 1
+            return None
+        self.tokens.move_to_end(key)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, access: AccessToken) -> None:
+        if not self.connected:
+            return
+        created = access.created_date.replace(tzinfo=UTC).timestamp()
+        self.tokens[hashlib.sha256(token.encode()).digest()] = (
+            access.user, created, created + access.lifetime.total_seconds())
+        while len(self.tokens) > self.max_size:
+            self.tokens.popitem(last=False)
+
+    def invalidate(self, user_id: UUID, invalidated_at: float) -> None:
+        now = time.time()
+        # older marks can't match any live token any more
+        self.invalidated = {key: value for key, value in self.invalidated.items()
+                            if value + Config.access_token_lifetime > now}
+        self.invalidated[user_id] = max(invalidated_at, self.invalidated.get(user_id, 0.0))
+        for callback in self.on_invalidate:
+            callback(user_id)
+
+    async def listen(self) -> None:
+        while True:
+            redis = get_redis_client()
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(RedisType.invalidated_access_token)
+                    # invalidations published while unsubscribed are lost
+                    self.clear()
+                    self.connected = True
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            user_id, invalidated_at = message["data"].split(":")
+                            self.invalidate(UUID(user_id), float(invalidated_at))
+            except RedisError:
+                await asyncio.sleep(1)
+            finally:
+                self.connected = False
+                await redis.aclose()
+
+
+async def invalidate_access_tokens(redis: Redis, user_id: UUID) -> None:
+    """Rejects every access token of the user issued up to now."""
+    invalidated_at = datetime.now(UTC).timestamp()
+    await redis.set(f"{RedisType.invalidated_access_token}:{user_id}", invalidated_at,
+                    ex=Config.access_token_lifetime)
+    await redis.publish(RedisType.invalidated_access_token, f"{user_id}:{invalidated_at}")
+
+
+async def get_invalidated_at(redis: Redis, user_id: UUID) -> float:
+    value = await redis.get(f"{RedisType.invalidated_access_token}:{user_id}")
+    return float(value) if value is not None else 0.0
+
+
+token_cache = AccessTokenCache(Config.access_token_cache_size)
+token_cache_listener: asyncio.Task[None] | None = None
+
+
+def open_token_cache() -> AccessTokenCache:
+    global token_cache_listener
+    if token_cache_listener is None:
+        token_cache_listener = asyncio.create_task(token_cache.listen())
+    return token_cache
+
+
+async def close_token_cache() -> None:
+    global token_cache_listener
+    if token_cache_listener is not None:
+        token_cache_listener.cancel()
+        try:
+            await token_cache_listener
+        except asyncio.CancelledError:
+            pass
+        token_cache_listener = None
@@ -0,0 +1,122 @@
+
+
+import time
+from collections import OrderedDict
+from typing import Any
+from uuid import UUID
+
+from deva_p1_db.models import User
+from deva_p1_db.repositories import UserRepository
+from pydantic import TypeAdapter, ValidationError
+from redis.asyncio import Redis
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import ColumnProperty, make_transient_to_detached
+
+from back.config import Config
+from back.schemas.user import CachedUserSchema
+from back.token_cache import token_cache
+from database.redis import RedisType
+
+
+class UserCache:
+    """In-process LRU in front of the redis user cache.
+
+    Local entries live for at most max_age seconds and are dropped on the
+    access token invalidation channel, so they are only trusted while that
+    subscription is up."""
+
+    def __init__(self, max_size: int, max_age: float) -> None:
+        self.max_size = max_size
+        self.max_age = max_age
+        self.users: OrderedDict[UUID, tuple[CachedUserSchema, float]] = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "size": len(self.users),
+            "max_size": self.max_size,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
+
+    def get(self, user_id: UUID) -> CachedUserSchema | None:
+        entry = self.users.get(user_id)
+        if entry is None or not token_cache.connected:
+            return None
+        user, expires = entry
+        if expires < time.monotonic():
+            del self.users[user_id]
+            return None
+        self.users.move_to_end(user_id)
+        return user
+
+    def put(self, user: CachedUserSchema) -> None:
+        if not token_cache.connected:
+            return
+        self.users[user.id] = (user, time.monotonic() + self.max_age)
+        while len(self.users) > self.max_size:
+            self.users.popitem(last=False)
+
+    def drop(self, user_id: UUID) -> None:
+        self.users.pop(user_id, None)
+
+    def clear(self) -> None:
+        self.users.clear()
+
+
+user_cache = UserCache(Config.user_cache_size, Config.user_cache_local_lifetime)
+token_cache.on_invalidate.append(user_cache.drop)
+token_cache.on_clear.append(user_cache.clear)
+
+
+async def get_cached_user(redis: Redis, ur: UserRepository, user_id: UUID) -> CachedUserSchema | None:
+    user = user_cache.get(user_id)
+    if user is not None:
+        user_cache.local_hits += 1
+        return user
+    cached = await redis.get(f"{RedisType.user_cache}:{user_id}")
+    try:
+        user = CachedUserSchema.model_validate_json(cached) if cached is not None else None
+    except ValidationError:
+        user = None
+    if user is not None and user.columns.keys() != set(inspect(User).column_attrs.keys()):
+        user = None  # written before the user table changed
+    if user is not None:
+        user_cache.redis_hits += 1
+    else:
+        user_cache.misses += 1
+        user_db = await ur.get_by_id(user_id)
+        if user_db is None:
+            return None
+        user = CachedUserSchema.from_db(user_db)
+        await redis.set(f"{RedisType.user_cache}:{user_id}", user.model_dump_json(),
+                        ex=Config.user_cache_lifetime)
+    user_cache.put(user)
+    return user
+
+
+async def invalidate_cached_user(redis: Redis, user_id: UUID) -> None:
+    await redis.delete(f"{RedisType.user_cache}:{user_id}")
+    user_cache.drop(user_id)
+
+
+def load_column(attr: ColumnProperty, value: Any) -> Any:
+    try:
+        python_type = attr.expression.type.python_type
+    except NotImplementedError:
+        return value
+    return TypeAdapter(python_type).validate_python(value)
+
+
+async def attach_cached_user(session: AsyncSession, user: CachedUserSchema) -> User:
+    """Turns the cached columns into a persistent User without a query.
+    Every column is loaded, relationships are not, so they still need an
+    explicit load under the async session."""
+    user_db = User(**{attr.key: load_column(attr, user.columns[attr.key])
+                      for attr in inspect(User).column_attrs})
+    make_transient_to_detached(user_db)
+    return await session.merge(user_db, load=False)
@@ -26,6 +26,16 @@ class Settings(BaseSettings):
     minio_password: str = "minioadmin"
     minio_bucket: str = "my-bucket"
     minio_secure: bool = False
+    minio_workers: int = 32
+    broker_prefetch: int = 32
+    broker_concurrency: int = 16
+    minio_pool_size: int = 32
+    minio_connect_timeout: float = 5
+    minio_read_timeout: float = 300
+    minio_retries: int = 3
+    minio_retry_backoff: float = 0.2
+    media_cache_dir: str = "/tmp/deva_media_cache"
+    media_cache_max_bytes: int = 10 * 1024 * 1024 * 1024
     
 
 settings = Settings()
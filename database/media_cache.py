@@ -0,0 +1,154 @@
+
+import asyncio
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+from typing import Any, BinaryIO
+
+from config import settings
+from database.minio import AsyncMinio
+
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+
+class MediaCache:
+    """Read-through disk cache of object segments in front of MinIO.
+
+    Objects are split into fixed-size segments keyed by object name, ETag and
+    segment index, so a changed object never hits stale segments. The total
+    size on disk is kept under max_bytes by evicting the least recently used
+    segments."""
+
+    def __init__(self, directory: str, max_bytes: int, segment_size: int = SEGMENT_SIZE) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self.segments: OrderedDict[tuple[str, str, int], int] = OrderedDict()
+        self.loading: dict[tuple[str, str, int], asyncio.Event] = {}
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def close(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def metrics(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "used_bytes": self.used_bytes,
+            "max_bytes": self.max_bytes,
+            "segments": len(self.segments),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes_served": self.bytes_served,
+        }
+
+    def segment_path(self, key: tuple[str, str, int]) -> str:
+        object_name, etag, index = key
+        # object names may contain slashes (blobs/<sha256>), the cache is flat
+        name = hashlib.sha1(object_name.encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.{etag}.{index}")
+
+    def evict(self) -> None:
+        while self.used_bytes > self.max_bytes and self.segments:
+            key, size = self.segments.popitem(last=False)
+            try:
+                os.remove(self.segment_path(key))
+            except FileNotFoundError:
+                pass
+            self.used_bytes -= size
+            self.evictions += 1
+
+    @staticmethod
+    def write_segment(path: str, data: bytes) -> None:
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    async def load_segment(self, storage: AsyncMinio, key: tuple[str, str, int], object_size: int) -> None:
+        object_name, _, index = key
+        while key not in self.segments:
+            if key in self.loading:
+                await self.loading[key].wait()
+                continue
+            self.misses += 1
+            self.loading[key] = asyncio.Event()
+            try:
+                offset = index * self.segment_size
+                length = min(self.segment_size, object_size - offset)
+                data = await (await storage.get_object(object_name, offset=offset, length=length)).read()
+                await asyncio.to_thread(self.write_segment, self.segment_path(key), data)
+                self.segments[key] = len(data)
+                self.used_bytes += len(data)
+                self.evict()
+            finally:
+                self.loading.pop(key).set()
+            return
+        self.hits += 1
+        self.segments.move_to_end(key)
+
+    async def open(self,
+                   storage: AsyncMinio,
+                   object_name: str,
+                   etag: str,
+                   object_size: int,
+                   start: int,
+                   end: int
+                   ) -> "CachedSegment | None":
+        """Opens the part of start..end that lies in the segment holding
+        start, loading the segment first if needed. Returns None when the
+        segment would not fit in the cache, so the caller reads storage."""
+        index = start // self.segment_size
+        segment_start = index * self.segment_size
+        if min(self.segment_size, object_size - segment_start) > self.max_bytes:
+            return None
+        key = (object_name, etag, index)
+        await self.load_segment(storage, key, object_size)
+        # no await between loading and opening, so the segment can't be evicted
+        # in between; once open, eviction only unlinks it
+        offset = start - segment_start
+        length = min(end - start + 1, self.segments[key] - offset)
+        self.bytes_served += length
+        return CachedSegment(open(self.segment_path(key), "rb"), offset, length)
+
+
+class CachedSegment:
+    def __init__(self, file: BinaryIO, offset: int, length: int) -> None:
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def read(self, offset: int, length: int) -> bytes:
+        return os.pread(self.file.fileno(), length, self.offset + offset)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+media_cache: MediaCache | None = None
+
+
+def open_media_cache() -> MediaCache:
+    global media_cache
+    if media_cache is None:
+        media_cache = MediaCache(os.path.join(settings.media_cache_dir, str(os.getpid())),
+                                 settings.media_cache_max_bytes)
+    return media_cache
+
+
+def close_media_cache() -> None:
+    global media_cache
+    if media_cache is not None:
+        media_cache.close()
+        media_cache = None
+
+
+async def get_media_cache() -> MediaCache:
+    return open_media_cache()
@@ -0,0 +1,38 @@
+"""outbox messages
+
+Revision ID: 3b9f6c2d7a41
+Revises: eea52f5c5330
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9f6c2d7a41'
+down_revision: Union[str, None] = 'eea52f5c5330'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('outbox_messages',
+    sa.Column('id', sa.Uuid(), nullable=False),
+    sa.Column('queue', sa.String(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('created_date', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('sent_date', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_messages_pending', 'outbox_messages', ['created_date'], unique=False,
+                    postgresql_where=sa.text('sent_date IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_outbox_messages_pending', table_name='outbox_messages',
+                  postgresql_where=sa.text('sent_date IS NULL'))
+    op.drop_table('outbox_messages')
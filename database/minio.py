@@ -1,13 +1,282 @@
 
-from minio import Minio
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from typing import Any, AsyncGenerator, AsyncIterator, BinaryIO, Callable, Iterator
+
+import certifi
+from minio import Minio, S3Error
+from minio.commonconfig import ComposeSource
+from minio.datatypes import Object, Part
+from urllib3 import BaseHTTPResponse, PoolManager, Retry, Timeout
 
 from config import settings
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadLimitExceeded(Exception):
+    pass
+
+
+class StoredStream:
+    def __init__(self, size: int, sha256: str) -> None:
+        self.size = size
+        self.sha256 = sha256
+
+
+class ObjectStream:
+    def __init__(self, storage: "AsyncMinio", response: BaseHTTPResponse, chunk_size: int = STREAM_CHUNK_SIZE) -> None:
+        self.storage = storage
+        self.response = response
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self) -> AsyncGenerator[bytes, None]:
+        try:
+            while chunk := await self.storage.run(self.response.read, self.chunk_size):
+                yield chunk
+        finally:
+            self.close()
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self])
+
+    def close(self) -> None:
+        self.response.close()
+        self.response.release_conn()
+
+
+class AsyncMinio:
+    """Runs the blocking minio client on a bounded thread pool so storage
+    round trips never stall the event loop. All calls target settings.minio_bucket."""
+
+    def __init__(self, client: Minio, http_client: PoolManager, executor: ThreadPoolExecutor) -> None:
+        self.client = client
+        self.http_client = http_client
+        self.executor = executor
+        self.bucket = settings.minio_bucket
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.http_client.clear()
+
+    def pool_metrics(self) -> dict[str, Any]:
+        pools = {}
+        for key in self.http_client.pools.keys():
+            pool = self.http_client.pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+            # the queue holds idle connections plus placeholders for unopened ones
+            in_use = pool.pool.maxsize - pool.pool.qsize()
+            pools[f"{key.key_host}:{key.key_port}"] = {
+                "max_size": pool.pool.maxsize,
+                "in_use": in_use,
+                "saturation": in_use / pool.pool.maxsize,
+                "opened_connections": pool.num_connections,
+                "requests": pool.num_requests,
+            }
+        return {
+            "pools": pools,
+            "workers": self.executor._max_workers,
+            "pending_calls": self.executor._work_queue.qsize(),
+        }
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def put_object(self, object_name: str, data: BinaryIO, length: int,
+                         content_type: str = "application/octet-stream",
+                         part_size: int = 0, num_parallel_uploads: int = 3) -> None:
+        await self.run(self.client.put_object, self.bucket, object_name, data, length,
+                       content_type=content_type, part_size=part_size,
+                       num_parallel_uploads=num_parallel_uploads)
+
+    async def put_stream(self, object_name: str, chunks: AsyncIterator[bytes], content_type: str,
+                         part_size: int, max_size: int, num_parallel_uploads: int = 3) -> StoredStream:
+        """Uploads chunks as they arrive through a multipart upload, so only
+        num_parallel_uploads parts are ever held in memory. Raises
+        UploadLimitExceeded as soon as more than max_size bytes came in."""
+        upload_id = await self.create_multipart_upload(object_name, content_type)
+        uploads: dict[int, asyncio.Task[str]] = {}
+        sha256 = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+
+        async def upload(data: bytes) -> None:
+            if len(uploads) >= num_parallel_uploads:
+                await asyncio.wait(uploads.values(), return_when=asyncio.FIRST_COMPLETED)
+                for task in uploads.values():
+                    if task.done():
+                        task.result()
+            part_number = len(uploads) + 1
+            uploads[part_number] = asyncio.create_task(self.upload_part(object_name, upload_id, part_number, data))
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadLimitExceeded()
+                sha256.update(chunk)
+                buffer += chunk
+                while len(buffer) >= part_size:
+                    await upload(bytes(buffer[:part_size]))
+                    del buffer[:part_size]
+            if buffer or not uploads:
+                await upload(bytes(buffer))
+            etags = {part_number: await task for part_number, task in uploads.items()}
+            await self.complete_multipart_upload(object_name, upload_id, etags)
+        except BaseException:
+            for task in uploads.values():
+                task.cancel()
+            await asyncio.gather(*uploads.values(), return_exceptions=True)
+            try:
+                await self.abort_multipart_upload(object_name, upload_id)
+            except S3Error:
+                pass  # the bucket lifecycle rule cleans up what is left
+            raise
+        return StoredStream(size, sha256.hexdigest())
+
+    async def get_object(self, object_name: str, offset: int = 0, length: int = 0) -> ObjectStream:
+        response = await self.run(self.client.get_object, self.bucket, object_name,
+                                  offset=offset, length=length)
+        return ObjectStream(self, response)
+
+    async def read_object(self, object_name: str) -> bytes:
+        return await (await self.get_object(object_name)).read()
+
+    async def stat_object(self, object_name: str) -> Object:
+        return await self.run(self.client.stat_object, self.bucket, object_name)
+
+    async def remove_object(self, object_name: str) -> None:
+        await self.run(self.client.remove_object, self.bucket, object_name)
 
-async def get_s3_client() -> Minio:
-    return Minio(
+    async def list_objects(self, prefix: str) -> list[str]:
+        def list_names() -> list[str]:
+            return [obj.object_name for obj in self.client.list_objects(self.bucket, prefix=prefix, recursive=True)
+                    if obj.object_name is not None]
+        return await self.run(list_names)
+
+    async def presigned_get_object(self, object_name: str, expires: timedelta,
+                                   response_headers: dict[str, str] | None = None) -> str:
+        return await self.run(self.client.presigned_get_object, self.bucket, object_name,
+                              expires=expires, response_headers=response_headers)
+
+    async def presigned_get_objects(self, object_names: list[str], expires: timedelta) -> list[str]:
+        # signing is local work, so a whole batch shares one executor round trip
+        def sign() -> list[str]:
+            return [self.client.presigned_get_object(self.bucket, object_name, expires=expires)
+                    for object_name in object_names]
+        return await self.run(sign)
+
+    async def presigned_put_object(self, object_name: str, expires: timedelta) -> str:
+        return await self.run(self.client.presigned_put_object, self.bucket, object_name, expires=expires)
+
+    async def move_object(self, source_name: str, object_name: str) -> None:
+        await self.run(self.client.compose_object, self.bucket, object_name,
+                       [ComposeSource(self.bucket, source_name)])
+        await self.remove_object(source_name)
+
+    async def create_multipart_upload(self, object_name: str, content_type: str) -> str:
+        return await self.run(self.client._create_multipart_upload,
+                              self.bucket, object_name, {"Content-Type": content_type})
+
+    async def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        return await self.run(self.client._upload_part,
+                              self.bucket, object_name, data, None, upload_id, part_number)
+
+    async def upload_part_stream(self, object_name: str, upload_id: str, part_number: int,
+                                 chunks: AsyncIterator[bytes], length: int) -> str:
+        """Streams one part of exactly length bytes into storage while chunks
+        arrive, holding a single chunk at a time. UploadPart signs the hash of
+        its whole payload, so the part goes through a presigned URL instead.
+        Raises UploadLimitExceeded when chunks do not add up to length."""
+        loop = asyncio.get_running_loop()
+        iterator = aiter(chunks)
+
+        async def next_chunk() -> bytes | None:
+            return await anext(iterator, None)
+
+        def body() -> Iterator[bytes]:
+            received = 0
+            while (chunk := asyncio.run_coroutine_threadsafe(next_chunk(), loop)
+                    .result(timeout=settings.minio_read_timeout)) is not None:
+                received += len(chunk)
+                if received > length:
+                    raise UploadLimitExceeded()
+                if chunk:
+                    yield chunk
+            if received != length:
+                # failing mid-body drops the connection instead of leaving
+                # storage waiting for the bytes the content length promised
+                raise UploadLimitExceeded()
+
+        def upload() -> str:
+            url = self.client.get_presigned_url("PUT", self.bucket, object_name,
+                                                expires=timedelta(hours=1),
+                                                extra_query_params={"partNumber": str(part_number),
+                                                                    "uploadId": upload_id})
+            # a generator body cannot be replayed, so retries stay off
+            response = self.http_client.urlopen("PUT", url, body=body(),
+                                                headers={"Content-Length": str(length)},
+                                                retries=False)
+            if response.status != 200:
+                raise S3Error.fromxml(response)
+            return response.headers["ETag"].replace('"', "")
+
+        return await self.run(upload)
+
+    async def complete_multipart_upload(self, object_name: str, upload_id: str, etags: dict[int, str]) -> None:
+        await self.run(self.client._complete_multipart_upload, self.bucket, object_name, upload_id,
+                       [Part(part_number, etags[part_number]) for part_number in sorted(etags)])
+
+    async def abort_multipart_upload(self, object_name: str, upload_id: str) -> None:
+        await self.run(self.client._abort_multipart_upload, self.bucket, object_name, upload_id)
+
+
+s3_client: AsyncMinio | None = None
+
+
+def create_s3_client() -> AsyncMinio:
+    http_client = PoolManager(
+        maxsize=settings.minio_pool_size,
+        block=True,
+        timeout=Timeout(connect=settings.minio_connect_timeout,
+                        read=settings.minio_read_timeout),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=Retry(total=settings.minio_retries,
+                      backoff_factor=settings.minio_retry_backoff,
+                      status_forcelist=[500, 502, 503, 504])
+    )
+    client = Minio(
         endpoint=f"{settings.minio_ip}:{settings.minio_port}",
         access_key=settings.minio_access_key,
         secret_key=settings.minio_secret_key,
-        secure=settings.minio_secure
+        secure=settings.minio_secure,
+        http_client=http_client
     )
+    executor = ThreadPoolExecutor(max_workers=settings.minio_workers,
+                                  thread_name_prefix="minio")
+    return AsyncMinio(client, http_client, executor)
+
+
+def open_s3_client() -> AsyncMinio:
+    global s3_client
+    if s3_client is None:
+        s3_client = create_s3_client()
+    return s3_client
+
+
+def close_s3_client() -> None:
+    global s3_client
+    if s3_client is not None:
+        s3_client.close()
+        s3_client = None
+
+
+async def get_s3_client() -> AsyncMinio:
+    return open_s3_client()
@@ -0,0 +1,24 @@
+
+from datetime import datetime
+from typing import Any
+from uuid import UUID, uuid4
+
+from deva_p1_db.models import Base
+from sqlalchemy import JSON, DateTime, Index, String, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class OutboxMessage(Base):
+    """A broker message written in the same transaction as the rows it
+    refers to and published later by the outbox relay."""
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        Index("ix_outbox_messages_pending", "created_date",
+              postgresql_where=text("sent_date IS NULL")),
+    )
+
+    id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
+    queue: Mapped[str] = mapped_column(String)
+    payload: Mapped[dict[str, Any]] = mapped_column(JSON)
+    created_date: Mapped[datetime] = mapped_column(DateTime, server_default=text("now()"))
+    sent_date: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
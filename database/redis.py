@@ -2,6 +2,7 @@
 from enum import Enum
 
 from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
 
 from config import settings
 
@@ -9,14 +10,34 @@ from config import settings
 class RedisType(str, Enum):
     incorrect_credentials = "incorrect_credentials",
     invalidated_access_token = "invalidated_access_token"
+    user_cache = "user_cache"
     incorrect_credentials_ip = "incorrect_credentials_ip"
+    register_attempts_ip = "register_attempts_ip"
     project_task_update = "project_task_update"
     project_update = "project_update"
+    project_version = "project_version"
+    project_consumer_lock = "project_consumer_lock"
     project_doc_bytes = "project_doc_bytes"
     task_done = "task_done"
     task_status = "task_status"
     task_cache = "task_cache"
     task_error = "task_error"
+    task_graph_dispatched = "task_graph_dispatched"
+    task_graph_progress = "task_graph_progress"
+    task_graph_origin = "task_graph_origin"
+    file_meta = "file_meta"
+    file_object = "file_object"
+    file_url = "file_url"
+    image_derivatives = "image_derivatives"
+    content_refs = "content_refs"
+    content_blob = "content_blob"
+    content_digest = "content_digest"
+    content_lock = "content_lock"
+    upload_session = "upload_session"
+    upload_session_parts = "upload_session_parts"
+    upload_session_expiry = "upload_session_expiry"
+    upload_ticket = "upload_ticket"
+    upload_ticket_expiry = "upload_ticket_expiry"
 
 
 def get_redis_client() -> Redis:
@@ -24,3 +45,9 @@ def get_redis_client() -> Redis:
                  port=settings.redis_port,
                  db=0,
                  decode_responses=True)
+
+
+def register_script(script: str) -> AsyncScript:
+    """Registers a Lua script once; run it with client=redis, the SHA is the
+    same on every connection."""
+    return get_redis_client().register_script(script)
@@ -0,0 +1,17 @@
+import secrets
+
+from deva_p1_db.models import User
+from deva_p1_db.repositories import UserRepository as BaseUserRepository
+
+
+class UserRepository(BaseUserRepository):
+    """UserRepository that can register users whose password was already
+    hashed, so the hashing stays off the event loop."""
+
+    async def create_with_hash(self, login: str, hashed_password: str) -> User:
+        user = User(login=login,
+                    hashed_password=hashed_password,
+                    secret=secrets.token_hex(32))
+        self.session.add(user)
+        await self.session.commit()
+        return user
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+import pytest
+from deva_p1_db.models import Base, File, InvitedUser, Note, Project, User
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    async_sessionmaker, create_async_engine)
+
+from back.depends.get_context import (AccessContext, get_file_context,
+                                      get_note_context, get_project_context)
+from back.exceptions import ProjectNotFoundException
+
+
+def create_engine() -> AsyncEngine:
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def add_now(dbapi_connection: Any, connection_record: Any) -> None:
+        # the models default their timestamps to postgres now()
+        dbapi_connection.create_function("now", 0, lambda: datetime.now().isoformat(" "))
+
+    return engine
+
+
+async def count_queries(engine: AsyncEngine,
+                        load: Callable[[AsyncSession], Awaitable[AccessContext]]
+                        ) -> tuple[AccessContext, int]:
+    """Runs load on a fresh session and counts the statements it sends."""
+    statements: list[str] = []
+
+    def record(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            context = await load(session)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+    return context, len(statements)
+
+
+async def check_query_budget() -> None:
+    engine = create_engine()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    holder, member, outsider = (User(id=uuid4(), login=login, hashed_password="", secret="")
+                                for login in ("holder", "member", "outsider"))
+    project = Project(id=uuid4(), name="project", description="", holder_id=holder.id,
+                      frames_extract_done=False)
+    file = File(id=uuid4(), file_name="file.txt", file_type="text", file_size=0,
+                user_id=holder.id, project_id=project.id)
+    note = Note(id=uuid4(), text="note", start_time_code=0.0, end_time_code=1.0, file_id=file.id)
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        for rows in ([holder, member, outsider], [project], [file],
+                     [note, InvitedUser(user_id=member.id, project_id=project.id, accepted=True)]):
+            session.add_all(rows)
+            await session.flush()
+        await session.commit()
+
+    context, queries = await count_queries(engine, lambda session: get_project_context(project.id, holder, session))
+    assert queries == 1
+    assert context.project.id == project.id and context.can_edit
+
+    context, queries = await count_queries(engine, lambda session: get_project_context(project.id, member, session))
+    assert queries == 1
+    assert context.is_member and context.can_view and not context.can_edit
+
+    context, queries = await count_queries(engine, lambda session: get_project_context(project.id, outsider, session))
+    assert queries == 1
+    assert not context.can_view
+
+    with pytest.raises(ProjectNotFoundException):
+        await count_queries(engine, lambda session: get_project_context(uuid4(), holder, session))
+
+    context, queries = await count_queries(engine, lambda session: get_file_context(file.id, member, session))
+    assert queries == 1
+    assert context.file is not None and context.file.id == file.id
+    assert context.project.id == project.id and context.can_view and not context.can_edit
+
+    context, queries = await count_queries(engine, lambda session: get_note_context(note.id, holder, session))
+    assert queries == 1
+    assert context.note is not None and context.note.id == note.id
+    assert context.project.id == project.id and context.can_edit
+    await engine.dispose()
+
+
+def test_access_contexts_take_one_query() -> None:
+    asyncio.run(check_query_budget())
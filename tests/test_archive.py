@@ -0,0 +1,123 @@
+import asyncio
+import random
+from io import BytesIO
+from types import SimpleNamespace
+from typing import AsyncGenerator
+from uuid import UUID, uuid4
+from zipfile import ZipFile
+
+from back.archive import (archive_object_name, remove_project_archives,
+                          store_archive, stream_project_archive,
+                          summary_object_name)
+from back.config import Config
+from database.redis import RedisType
+
+
+class FakeStorage:
+    """In-memory storage whose reads finish after a random delay, so
+    prefetched members complete out of order."""
+
+    def __init__(self, objects: dict[str, bytes]) -> None:
+        self.objects = objects
+        self.parts: dict[str, dict[int, bytes]] = {}
+        self.reading = 0
+        self.max_reading = 0
+
+    async def list_objects(self, prefix: str) -> list[str]:
+        return [name for name in self.objects if name.startswith(prefix)]
+
+    async def remove_object(self, object_name: str) -> None:
+        del self.objects[object_name]
+
+    async def create_multipart_upload(self, object_name: str, content_type: str) -> str:
+        return object_name
+
+    async def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        self.parts.setdefault(upload_id, {})[part_number] = data
+        return str(part_number)
+
+    async def complete_multipart_upload(self, object_name: str, upload_id: str, etags: dict[int, str]) -> None:
+        parts = self.parts.pop(upload_id)
+        self.objects[object_name] = b"".join(parts[part_number] for part_number in sorted(etags))
+
+    async def abort_multipart_upload(self, object_name: str, upload_id: str) -> None:
+        self.parts.pop(upload_id, None)
+
+    async def read_object(self, object_name: str) -> bytes:
+        self.reading += 1
+        self.max_reading = max(self.max_reading, self.reading)
+        try:
+            await asyncio.sleep(random.uniform(0, 0.005))
+            return self.objects[object_name]
+        finally:
+            self.reading -= 1
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.values: dict[str, int] = {}
+
+    async def set(self, key: str, value: int, nx: bool = False) -> None:
+        if not nx or key not in self.values:
+            self.values[key] = value
+
+    async def get(self, key: str) -> int:
+        return self.values[key]
+
+
+async def build_archive(project: SimpleNamespace, images: list[SimpleNamespace],
+                        storage: FakeStorage, version: int) -> bytes:
+    object_names = {file.id: str(file.id) for file in [*images, project.transcription, project.summary]}
+    chunks = stream_project_archive(project, images, object_names, version, storage)  # type: ignore[arg-type]
+    return b"".join([chunk async for chunk in chunks])
+
+
+def test_archive_keeps_member_order_with_prefetch() -> None:
+    random.seed(4)
+    images = [SimpleNamespace(id=uuid4(), file_name=f"frame_{index}.png") for index in range(40)]
+    transcription = SimpleNamespace(id=uuid4(), file_name="transcription.txt")
+    summary = SimpleNamespace(id=uuid4(), file_name="summary.md")
+    project = SimpleNamespace(id=uuid4(), transcription=transcription, summary=summary)
+    storage = FakeStorage({str(file.id): f"content of {file.file_name}".encode() * (index + 1)
+                           for index, file in enumerate([*images, transcription])})
+    storage.objects[summary_object_name(project.id, 3)] = b"# summary"
+
+    archive = ZipFile(BytesIO(asyncio.run(build_archive(project, images, storage, 3))))
+
+    names = [f"images/{image.file_name}" for image in images] + ["transcription.txt", "summary.md"]
+    assert archive.namelist() == names
+    for index, file in enumerate([*images, transcription]):
+        assert archive.read(names[index]) == f"content of {file.file_name}".encode() * (index + 1)
+    assert archive.read("summary.md") == b"# summary"
+    assert 1 < storage.max_reading <= Config.archive_prefetch + 1
+
+
+async def download(storage: FakeStorage, redis: FakeRedis, project_id: UUID, version: int,
+                   moved_to: int | None = None) -> bytes:
+    async def chunks() -> AsyncGenerator[bytes, None]:
+        yield b"archive"
+        if moved_to is not None:
+            await redis.set(f"{RedisType.project_version}:{project_id}", moved_to)
+        yield b" of %d" % version
+
+    stored = store_archive(chunks(), project_id, version, storage, redis)  # type: ignore[arg-type]
+    return b"".join([chunk async for chunk in stored])
+
+
+def test_late_archive_never_replaces_a_newer_one() -> None:
+    project_id = uuid4()
+    storage = FakeStorage({summary_object_name(project_id, 1): b"", summary_object_name(project_id, 3): b""})
+    redis = FakeRedis()
+
+    asyncio.run(redis.set(f"{RedisType.project_version}:{project_id}", 2))
+    assert asyncio.run(download(storage, redis, project_id, 2)) == b"archive of 2"
+    assert sorted(storage.objects) == sorted([archive_object_name(project_id, 2),
+                                              summary_object_name(project_id, 3)])
+
+    # the project changes while this download streams, so it is not stored
+    assert asyncio.run(download(storage, redis, project_id, 2, moved_to=4)) == b"archive of 2"
+    assert not storage.parts
+    assert archive_object_name(project_id, 2) in storage.objects
+
+    asyncio.run(remove_project_archives(storage, project_id))  # type: ignore[arg-type]
+    assert not storage.objects
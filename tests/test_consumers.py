@@ -0,0 +1,82 @@
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable
+from uuid import UUID, uuid4
+
+from starlette.concurrency import run_in_threadpool
+
+from back.consumers import ConsumerGroup, ConsumerSlot
+
+
+class FakeLock:
+    def __init__(self, lock: asyncio.Lock) -> None:
+        self.lock = lock
+
+    async def acquire(self) -> None:
+        await self.lock.acquire()
+
+    async def release(self) -> None:
+        self.lock.release()
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.locks: dict[str, asyncio.Lock] = {}
+
+    def lock(self, name: str, timeout: float) -> FakeLock:
+        return FakeLock(self.locks.setdefault(name, asyncio.Lock()))
+
+
+def sync_dependency(delay: float) -> None:
+    # like get_redis_client: a plain function FastAPI runs on the thread pool
+    time.sleep(delay)
+
+
+async def deliver_all(projects: list[UUID],
+                      claim: Callable[[ConsumerSlot, Any, UUID], Awaitable[None]]
+                      ) -> dict[UUID, list[int]]:
+    group = ConsumerGroup(concurrency=8)
+    consume = group.middleware("test")
+    redis = FakeRedis()
+    handled: dict[UUID, list[int]] = {project_id: [] for project_id in projects}
+
+    async def handler(message: Any) -> None:
+        await run_in_threadpool(sync_dependency, random.uniform(0, 0.005))
+        slot = group.slot(message)
+        await claim(slot, redis, message.project_id)
+        await asyncio.sleep(random.uniform(0, 0.002))
+        handled[message.project_id].append(message.index)
+
+    messages = [SimpleNamespace(index=index, project_id=project_id,
+                                raw_message=SimpleNamespace(timestamp=None))
+                for index, project_id in enumerate(projects)]
+    # aiormq starts one task per delivery, in delivery order
+    await asyncio.gather(*(asyncio.create_task(consume(handler, message)) for message in messages))  # type: ignore[arg-type]
+    assert not group.slots and not group.queued
+    return handled
+
+
+def test_messages_of_a_project_keep_delivery_order() -> None:
+    random.seed(25)
+    project_ids = [uuid4() for _ in range(5)]
+    projects = [random.choice(project_ids) for _ in range(300)]
+
+    handled = asyncio.run(deliver_all(projects, lambda slot, redis, key: slot.claim_project(redis, key)))
+
+    for project_id, indexes in handled.items():
+        assert indexes == sorted(indexes)
+        assert len(indexes) == projects.count(project_id)
+
+
+def test_progress_of_a_task_keeps_delivery_order() -> None:
+    random.seed(24)
+    task_ids = [uuid4() for _ in range(5)]
+    tasks = [random.choice(task_ids) for _ in range(300)]
+
+    handled = asyncio.run(deliver_all(tasks, lambda slot, redis, key: slot.wait_turn(key)))
+
+    for task_id, indexes in handled.items():
+        assert indexes == sorted(indexes)
+        assert len(indexes) == tasks.count(task_id)
@@ -0,0 +1,62 @@
+import asyncio
+from io import BytesIO
+
+from database.media_cache import MediaCache
+
+
+class FakeStorage:
+    def __init__(self, objects: dict[str, bytes]) -> None:
+        self.objects = objects
+        self.reads = 0
+
+    async def get_object(self, object_name: str, offset: int = 0, length: int = 0) -> BytesIO:
+        self.reads += 1
+        return AsyncBytes(self.objects[object_name][offset:offset + length])
+
+
+class AsyncBytes(BytesIO):
+    async def read(self, size: int = -1) -> bytes:  # type: ignore[override]
+        return super().read(size)
+
+
+async def read_all(cache: MediaCache, storage: FakeStorage, object_name: str, start: int, end: int) -> bytes:
+    """Reads start..end the way a player does, one cached segment at a time."""
+    size = len(storage.objects[object_name])
+    data = b""
+    while start <= end:
+        segment = await cache.open(storage, object_name, "etag", size, start, end)  # type: ignore[arg-type]
+        assert segment is not None
+        data += segment.read(0, segment.length)
+        segment.close()
+        start += segment.length
+    return data
+
+
+def test_serves_objects_with_slashes_in_name(tmp_path) -> None:
+    content = bytes(range(256)) * 40
+    storage = FakeStorage({"blobs/deadbeef": content})
+    cache = MediaCache(str(tmp_path / "cache"), max_bytes=1 << 20, segment_size=1024)
+
+    assert asyncio.run(read_all(cache, storage, "blobs/deadbeef", 100, 5000)) == content[100:5001]
+    assert asyncio.run(read_all(cache, storage, "blobs/deadbeef", 0, len(content) - 1)) == content
+    assert cache.hits > 0
+
+
+def test_evicts_least_recently_used_segments(tmp_path) -> None:
+    content = b"x" * 4096
+    storage = FakeStorage({"blobs/a": content, "blobs/b": content})
+    cache = MediaCache(str(tmp_path / "cache"), max_bytes=4096, segment_size=1024)
+
+    asyncio.run(read_all(cache, storage, "blobs/a", 0, 4095))
+    asyncio.run(read_all(cache, storage, "blobs/b", 0, 1023))
+
+    assert cache.used_bytes <= 4096
+    assert cache.evictions == 1
+
+
+def test_leaves_segments_larger_than_the_cache_to_storage(tmp_path) -> None:
+    storage = FakeStorage({"blobs/a": b"x" * 4096})
+    cache = MediaCache(str(tmp_path / "cache"), max_bytes=512, segment_size=1024)
+
+    assert asyncio.run(cache.open(storage, "blobs/a", "etag", 4096, 0, 4095)) is None  # type: ignore[arg-type]
+    assert storage.reads == 0 and cache.used_bytes == 0